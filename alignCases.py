@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import collections
+import numpy as np
+import profiling
+from query import queryOf
+
+# Entries that are not countries, and countries left out of the axis bounds
+defaultIgnoreCountries = ['Worldwide', 'International conveyance (Diamond Princess)', 'International', 'Others', 'World', 'Cruise Ship']
+defaultMaxExcludeCountry = ['China']
+
+# Aligned data for plotting
+# series[country] = cases from the day the daily increase first passed the threshold (empty if it never did)
+# onsets[country] = index of that day among the country's dates with data
+# minEntry, maxEntry, maxDays = axis bounds over the countries not in maxExcludeCountry, within dayLimit days
+Alignment = collections.namedtuple('Alignment', ['series', 'onsets', 'minEntry', 'maxEntry', 'maxDays'])
+
+# Prepared matrix of one metric for the selected countries, reused for many thresholds
+# cases[iCountry, iPoint] = case of the iPoint-th date with data (dates without data are skipped)
+# nPoints[iCountry] = number of dates with data
+Prepared = collections.namedtuple('Prepared', ['countries', 'cases', 'nPoints'])
+
+# Countries to plot, sorted by their latest value of data[country][date][sortIndex] (deaths by default)
+# maxCountries keeps only that many countries from the top, -1 keeps all
+def selectCountries(data, interestedCountries=[], ignoreCountries=[], sortIndex=4, maxCountries=-1):
+  return queryOf(data).topK(sortIndex, maxCountries, include=interestedCountries, exclude=ignoreCountries)
+
+def prepareAlignment(data, interestedIndex, countries):
+  indices = np.array([data.countryIndex[country] for country in countries], dtype=np.intp)
+  cases = np.asarray(data.values[indices, :, interestedIndex], dtype=np.float64)
+  valid = np.asarray(data.valid[indices, :, interestedIndex])
+  # Move dates with data to the front of each row, keeping their order
+  order = np.argsort(~valid, axis=1, kind='stable')
+  cases = np.take_along_axis(cases, order, axis=1)
+  nPoints = valid.sum(axis=1)
+  # Countries without any data are dropped, as nothing can be drawn for them
+  hasData = nPoints != 0
+  return Prepared([country for country, keep in zip(countries, hasData) if keep], cases[hasData], nPoints[hasData])
+
+# Finds for every country the first day whose increase to the next day is above lowLimitCase, in one pass
+def alignPrepared(prepared, lowLimitCase, dayLimit=-1, maxExcludeCountry=[]):
+  cases, nPoints = prepared.cases, prepared.nPoints
+  nCountries, nDates = cases.shape
+  points = np.arange(nDates)
+  increases = np.diff(cases, axis=1)
+  passed = (increases > lowLimitCase) & (points[None, :-1] < nPoints[:, None]-1)
+  hasPassed = passed.any(axis=1)
+  onsets = np.where(hasPassed, passed.argmax(axis=1) if nDates > 1 else 0, nPoints)
+
+  # Axis bounds from the first dayLimit aligned days of countries not excluded
+  lengths = nPoints - onsets
+  windows = lengths if dayLimit == -1 else np.minimum(lengths, dayLimit)
+  windows = np.where([country in maxExcludeCountry for country in prepared.countries], 0, windows)
+  inWindow = (points[None, :] >= onsets[:, None]) & (points[None, :] < (onsets+windows)[:, None])
+  minEntry, maxEntry, maxDays = 0, 0, 0
+  if inWindow.any():
+    minEntry = min(minEntry, cases[inWindow].min())
+    maxEntry = max(maxEntry, cases[inWindow].max())
+    maxDays = max(maxDays, windows.max()-1)
+
+  series = collections.OrderedDict()
+  onsetDict = collections.OrderedDict()
+  for iCountry, country in enumerate(prepared.countries):
+    series[country] = cases[iCountry, onsets[iCountry]:nPoints[iCountry]]
+    onsetDict[country] = int(onsets[iCountry])
+  return Alignment(series, onsetDict, minEntry, maxEntry, maxDays)
+
+# Aligns countries on the day their daily increase of data[country][date][interestedIndex] passes lowLimitCase
+# data can also hold regions, as data.regions does, in which case region names take the place of countries
+# Countries are ordered by sortIndex, keeping the first maxCountries as in selectCountries
+def alignCases(data, interestedIndex=3, lowLimitCase=200, dayLimit=-1, interestedCountries=[], ignoreCountries=[], maxExcludeCountry=[], sortIndex=4, maxCountries=-1):
+  with profiling.stage('selectCountries') as timer:
+    countries = selectCountries(data, interestedCountries, ignoreCountries, sortIndex, maxCountries)
+    timer.add(countries=len(countries))
+  with profiling.stage('align') as timer:
+    prepared = prepareAlignment(data, interestedIndex, countries)
+    timer.add(cells=prepared.cases.size)
+    return alignPrepared(prepared, lowLimitCase, dayLimit, maxExcludeCountry)
+
+# Aligns the same countries for several thresholds, preparing the metric matrix only once
+# Returns alignments[lowLimitCase] = Alignment
+def sweepThresholds(data, interestedIndex, lowLimitCases, dayLimit=-1, interestedCountries=[], ignoreCountries=[], maxExcludeCountry=[], sortIndex=4, maxCountries=-1):
+  prepared = prepareAlignment(data, interestedIndex, selectCountries(data, interestedCountries, ignoreCountries, sortIndex, maxCountries))
+  return collections.OrderedDict((lowLimitCase, alignPrepared(prepared, lowLimitCase, dayLimit, maxExcludeCountry)) for lowLimitCase in lowLimitCases)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+import time
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+import getData
+from getData import getDataFromWorldInData, getDataFromJohnHopkins
+from timeSeries import deriveMetrics, rollUpRegions
+from alignCases import alignCases, defaultIgnoreCountries, defaultMaxExcludeCountry
+import profiling
+
+# Synthetic cumulative cases, growing roughly like an epidemic with a random onset per row
+# Returns totals[iRow, iDay] (int64, never decreasing)
+def syntheticTotals(rng, nRows, nDays):
+  onsets = rng.integers(0, max(nDays//2, 1), nRows)
+  rates = rng.uniform(0.05, 0.3, nRows)
+  days = np.arange(nDays)
+  growth = np.exp(rates[:, None] * np.maximum(days[None, :]-onsets[:, None], 0))
+  daily = rng.poisson(np.minimum(growth, 1e6)) * (days[None, :] >= onsets[:, None])
+  return np.cumsum(daily, axis=1)
+
+# Writes a World in Data style long csv: date,location,new_cases,new_deaths,total_cases,total_deaths
+# Each country starts reporting on its own day, and some new_cases cells are left empty
+def generateWorldInData(filepath, nCountries=200, nDays=365, seed=1):
+  rng = np.random.default_rng(seed)
+  cases = syntheticTotals(rng, nCountries, nDays)
+  deaths = cases//30
+  newCases, newDeaths = np.diff(cases, axis=1, prepend=0), np.diff(deaths, axis=1, prepend=0)
+  firstDays = rng.integers(0, max(nDays//4, 1), nCountries)
+  emptyCells = rng.random((nCountries, nDays)) < 0.05
+  dates = [str(date) for date in np.datetime64('2020-01-01') + np.arange(nDays)]
+  with open(filepath, 'w') as outFile:
+    outFile.write('date,location,new_cases,new_deaths,total_cases,total_deaths\n')
+    for iCountry in range(nCountries):
+      country = 'Country%04d' % iCountry
+      for iDay in range(firstDays[iCountry], nDays):
+        newCase = '' if emptyCells[iCountry, iDay] else str(newCases[iCountry, iDay])
+        outFile.write('%s,%s,%s,%d,%d,%d\n' % (dates[iDay], country, newCase, newDeaths[iCountry, iDay], cases[iCountry, iDay], deaths[iCountry, iDay]))
+  return nCountries*nDays - int(firstDays.sum())
+
+# Writes John Hopkins style wide csvs (Confirmed, Deaths, Recovered) to folder
+# Province/State,Country/Region,Lat,Long,cases per date... with regionsPerCountry rows per country,
+# the first of which has no Province/State, and a few countries under the aliases in getData.combineCountries
+def generateJohnHopkins(folder, nCountries=200, regionsPerCountry=15, nDays=365, seed=1):
+  rng = np.random.default_rng(seed)
+  aliases = [alias for country in getData.combineCountries for alias in getData.combineCountries[country]]
+  countries = aliases + ['Country%04d' % iCountry for iCountry in range(max(nCountries-len(aliases), 0))]
+  heads = []
+  for country in countries:
+    for iRegion in range(regionsPerCountry):
+      region = 'Region%03d' % iRegion if iRegion != 0 else ''
+      heads.append('%s,"%s",%.4f,%.4f,' % (region, country, rng.uniform(-90, 90), rng.uniform(-180, 180)))
+  confirmed = syntheticTotals(rng, len(heads), nDays)
+  dates = [date.astype(datetime.date) for date in np.datetime64('2020-01-22') + np.arange(nDays)]
+  header = 'Province/State,Country/Region,Lat,Long,' + ','.join('%d/%d/%s' % (date.month, date.day, date.strftime('%y')) for date in dates) + '\n'
+  for name, cases in [('Confirmed', confirmed), ('Deaths', confirmed//20), ('Recovered', confirmed//3)]:
+    with open(os.path.join(folder, 'time_series_19-covid-%s.csv' % name), 'w') as outFile:
+      outFile.write(header)
+      for head, row in zip(heads, cases):
+        outFile.write(head + ','.join(map(str, row.tolist())) + '\n')
+  return len(heads)
+
+# Runs function repeat times with its output hidden, keeping the fastest run
+# setup() is called before every run, outside of the timing
+# Peak memory is traced in one extra run, as tracing slows down the timed ones
+# Returns (seconds, peakBytes, result of the last run)
+def measure(function, repeat=3, setup=None):
+  bestTime, result = float('inf'), None
+  for iRepeat in range(repeat+1):
+    if setup is not None: setup()
+    traced = iRepeat == repeat
+    if traced: tracemalloc.start()
+    startTime = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+      result = function()
+    elapsed = time.perf_counter() - startTime
+    if traced:
+      peakBytes = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    else:
+      bestTime = min(bestTime, elapsed)
+  return bestTime, peakBytes, result
+
+# Removes cached datasets so ingest stages parse from csv every time
+def clearCaches(folder):
+  getData.parsedData.clear()
+  for path in glob.glob(os.path.join(folder, '*.cache.*')): os.remove(path)
+
+# Draws nPlots plots through makeGraphs.drawAlignment on its shared figure after warmUp plots
+# After 50 plots the peak RSS still grows by about 13 MB over the next 200, while matplotlib fills its bounded text
+# and font caches, and stays flat after that, which is why --maxGrowthMB defaults to 32
+# Returns (seconds, growthMB, figures) with growthMB = growth of the peak RSS over the nPlots plots
+# and figures = number of figures left registered with pyplot
+def plotMemory(data, folder, nPlots=200, warmUp=50):
+  import makeGraphs
+  makeGraphs.setBatch()
+  import matplotlib.pyplot as pyplot
+  interestedCountries = list(alignCases(data, 4, 0).series)[:10]
+  # Plots with different numbers of countries, so lines are added and removed
+  alignments = [alignCases(data, iMetric, lowLimitCase, interestedCountries=interestedCountries) for iMetric, lowLimitCase in [(3, 150), (4, 7), (5, 10), (6, 1e4)]]
+  def draw(iPlot):
+    makeGraphs.drawAlignment(alignments[iPlot%len(alignments)], title='Memory', filename=os.path.join(folder, 'memory.png'))
+  with contextlib.redirect_stdout(io.StringIO()):
+    for iPlot in range(warmUp): draw(iPlot)
+    startRss = profiling.peakRssMB()
+    startTime = time.perf_counter()
+    for iPlot in range(nPlots): draw(iPlot)
+    seconds = time.perf_counter() - startTime
+  growthMB = profiling.peakRssMB() - startRss
+  figures = len(pyplot.get_fignums())
+  makeGraphs.closePlotContext()
+  return seconds, growthMB, figures
+
+# Times every stage on synthetic data written to folder
+# Returns results[stage] = {'seconds', 'peakMB', 'items', 'itemsPerSecond', 'unit'}
+def runBenchmarks(folder, nCountries=200, regionsPerCountry=15, nDays=365, repeat=3, render=True, stages=None, memoryPlots=200):
+  results = {}
+  def record(stage, seconds, peakBytes, items, unit):
+    results[stage] = {'seconds': seconds, 'peakMB': peakBytes/1e6, 'items': items, 'itemsPerSecond': items/max(seconds, 1e-9), 'unit': unit}
+    print('%-18s %9.4f s %10.1f MB %14.0f %s/s' % (stage, seconds, peakBytes/1e6, items/max(seconds, 1e-9), unit))
+  def selected(stage):
+    return stages is None or stage in stages
+
+  wdRows = generateWorldInData(os.path.join(folder, 'full_data.csv'), nCountries, nDays)
+  jhRows = generateJohnHopkins(folder, nCountries, regionsPerCountry, nDays)
+  print('Generated %d World in Data rows and 3 x %d John Hopkins rows of %d days in %s' % (wdRows, jhRows, nDays, folder))
+
+  if selected('ingestWorldInData'):
+    seconds, peakBytes, wdData = measure(lambda: getDataFromWorldInData(folder, fetch=False), repeat, lambda: clearCaches(folder))
+    record('ingestWorldInData', seconds, peakBytes, wdRows, 'rows')
+  if selected('ingestJohnHopkins'):
+    seconds, peakBytes, jhData = measure(lambda: getDataFromJohnHopkins(folder, fetch=False), repeat, lambda: clearCaches(folder))
+    record('ingestJohnHopkins', seconds, peakBytes, 3*jhRows, 'rows')
+  # Data for the later stages, also making sure the cache exists
+  with contextlib.redirect_stdout(io.StringIO()):
+    jhData = getDataFromJohnHopkins(folder, fetch=False)
+  if selected('loadCache'):
+    seconds, peakBytes, cached = measure(lambda: getDataFromJohnHopkins(folder, fetch=False), repeat, getData.parsedData.clear)
+    record('loadCache', seconds, peakBytes, jhRows, 'regions')
+  cells = len(jhData.countries)*len(jhData.dates)
+
+  if selected('rollUp'):
+    seconds, peakBytes, rolled = measure(lambda: rollUpRegions(jhData.regions), repeat)
+    record('rollUp', seconds, peakBytes, len(jhData.regions.countries)*len(jhData.dates), 'cells')
+  if selected('derive'):
+    values = np.array(jhData.values)
+    def restore():
+      jhData.values = np.array(values)
+    seconds, peakBytes, corrections = measure(lambda: deriveMetrics(jhData), repeat, restore)
+    record('derive', seconds, peakBytes, cells, 'cells')
+  if selected('align'):
+    seconds, peakBytes, alignment = measure(lambda: alignCases(jhData, 3, 150, ignoreCountries=defaultIgnoreCountries, maxExcludeCountry=defaultMaxExcludeCountry), repeat)
+    record('align', seconds, peakBytes, cells, 'cells')
+  if render and selected('render'):
+    # matplotlib is only needed for this stage
+    from renderPool import renderPlots
+    # A legend with every country is not what is measured, so plot the 10 countries with most deaths
+    interestedCountries = list(alignCases(jhData, 4, 0).series)[:10]
+    plots = [dict(interestedIndex=iMetric, title='Benchmark', filename=os.path.join(folder, 'benchmark%d.png' % iMetric), lowLimitCase=150, interestedCountries=interestedCountries) for iMetric in [3, 4, 5, 6]]
+    seconds, peakBytes, timings = measure(lambda: renderPlots(jhData, plots), repeat)
+    record('render', seconds, peakBytes, len(plots), 'plots')
+  if render and selected('plotMemory') and memoryPlots > 0:
+    # Peak RSS over many plots on the shared figure, which has to stay flat
+    seconds, growthMB, figures = plotMemory(jhData, folder, memoryPlots)
+    record('plotMemory', seconds, 0, memoryPlots, 'plots')
+    results['plotMemory'].update(rssGrowthMB=growthMB, pyplotFigures=figures)
+    print('%-18s peak RSS grew %.1f MB over %d plots, %d pyplot figures' % ('plotMemory', growthMB, memoryPlots, figures))
+  return results
+
+def gitCommit():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return ''
+
+# Compares results with a baseline report, flagging stages more than threshold (fraction) slower
+# Differences below minSeconds are timer noise and never count
+# Returns the names of the regressed stages
+def compareResults(results, baseline, threshold=0.2, minSeconds=0.002):
+  regressions = []
+  for stage in results:
+    if stage not in baseline: continue
+    ratio = results[stage]['seconds'] / max(baseline[stage]['seconds'], 1e-9)
+    regressed = ratio > 1+threshold and results[stage]['seconds']-baseline[stage]['seconds'] > minSeconds
+    if regressed: regressions.append(stage)
+    print('%-18s %9.4f s -> %9.4f s (%+6.1f%%)%s' % (stage, baseline[stage]['seconds'], results[stage]['seconds'], (ratio-1)*100, ' REGRESSION' if regressed else ''))
+  return regressions
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='Times ingest, derive, align and render on synthetic data.')
+  parser.add_argument('--countries', default=200, type=int, help='Number of countries')
+  parser.add_argument('--regions', default=15, type=int, help='Number of Province/State rows per country in John Hopkins data')
+  parser.add_argument('--days', default=365, type=int, help='Number of days')
+  parser.add_argument('--repeat', default=3, type=int, help='Number of runs per stage, the fastest is kept')
+  parser.add_argument('--stages', default=[], nargs='*', help='Only run these stages (ingestWorldInData, ingestJohnHopkins, loadCache, rollUp, derive, align, render, plotMemory)')
+  parser.add_argument('--noRender', default=False, action='store_true', help='Skip the render stage')
+  parser.add_argument('--memoryPlots', default=200, type=int, help='Number of plots of the plotMemory stage')
+  parser.add_argument('--maxGrowthMB', default=32, type=float, help='Peak RSS growth over the plotMemory stage above which the run fails')
+  parser.add_argument('--workFolder', default='', help='Folder for the synthetic data, a temporary folder by default')
+  parser.add_argument('--output', default='', help='Write the results as json to this file')
+  parser.add_argument('--compare', default='', help='Compare with the results of an earlier --output')
+  parser.add_argument('--threshold', default=0.2, type=float, help='Fraction a stage may be slower than in --compare before it counts as a regression')
+  args = parser.parse_args()
+
+  folder = args.workFolder if args.workFolder != '' else tempfile.mkdtemp(prefix='coronavirusBenchmark')
+  if not os.path.exists(folder): os.makedirs(folder)
+  try:
+    results = runBenchmarks(folder, args.countries, args.regions, args.days, args.repeat, render=not args.noRender, stages=args.stages or None, memoryPlots=args.memoryPlots)
+  finally:
+    if args.workFolder == '': shutil.rmtree(folder)
+
+  report = {
+      'commit': gitCommit(),
+      'date': datetime.datetime.now().isoformat(),
+      'config': {'countries': args.countries, 'regions': args.regions, 'days': args.days, 'repeat': args.repeat, 'memoryPlots': args.memoryPlots},
+      'results': results,
+      }
+  if args.output != '':
+    with open(args.output, 'w') as outFile:
+      json.dump(report, outFile, indent=2, sort_keys=True)
+    print('Saving '+args.output)
+
+  if args.compare != '':
+    with open(args.compare) as inFile:
+      baseline = json.load(inFile)
+    sameScale = dict((key, value) for key, value in baseline['config'].items() if key != 'repeat') == dict((key, value) for key, value in report['config'].items() if key != 'repeat')
+    if not sameScale: print('Warning: comparing with a run of another configuration '+json.dumps(baseline['config']))
+    print('Compared with '+(baseline.get('commit') or args.compare))
+    regressions = compareResults(results, baseline['results'], args.threshold)
+    if len(regressions) != 0:
+      print('Regressions in '+', '.join(regressions))
+      raise SystemExit(1)
+
+  # Drawing many plots must not grow memory or leave figures registered with pyplot
+  if 'plotMemory' in results and (results['plotMemory']['rssGrowthMB'] > args.maxGrowthMB or results['plotMemory']['pyplotFigures'] != 0):
+    print('Memory grew while plotting: %.1f MB over %d plots, %d pyplot figures' % (results['plotMemory']['rssGrowthMB'], args.memoryPlots, results['plotMemory']['pyplotFigures']))
+    raise SystemExit(1)
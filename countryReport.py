@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+import concurrent.futures
+import os
+import re
+import time
+import numpy as np
+import profiling
+from alignCases import selectCountries, defaultIgnoreCountries
+from downsample import tickStep
+from renderPool import initWorker
+from rollingStatistics import allMetricNames
+
+# Report with one page per country, showing every metric of the country in its own small plot
+# All countries are selected and aligned once, then pages are drawn on one reused figure per process.
+# Days count from the first day with cases (data[country][date][3] > 0) of each country.
+
+# Metrics with any value in data, as indices in data[country][date]
+def reportMetrics(data):
+  return [iMetric for iMetric in range(data.values.shape[2]) if data.valid[:, :, iMetric].any()]
+
+# Aligned values of countries for the report
+# Returns (values, nDays) with values[iCountry, iDay, iMetric] = value of metrics[iMetric] iDay days after the
+# first case of countries[iCountry] (nan without data) and nDays[iCountry] = number of days from the first case
+def alignReport(data, countries, metrics):
+  indices = np.array([data.countryIndex[country] for country in countries], dtype=np.intp)
+  values = np.where(data.valid[indices][:, :, metrics], data.values[indices][:, :, metrics], np.nan).astype(np.float64)
+  hasCases = data.valid[indices, :, 3] & (data.values[indices, :, 3] > 0)
+  nDates = values.shape[1]
+  # Shift each row so the first day with cases comes first
+  onsets = np.where(hasCases.any(axis=1), np.argmax(hasCases, axis=1), nDates)
+  shifted = np.arange(nDates)[None, :] + onsets[:, None]
+  aligned = np.take_along_axis(values, np.minimum(shifted, max(nDates-1, 0))[:, :, None], axis=1)
+  aligned[shifted >= nDates] = np.nan
+  return aligned, nDates-onsets
+
+# Filename of the page of a country in a png report
+def pageFilename(folder, country):
+  return os.path.join(folder, re.sub('[^A-Za-z0-9]+', '_', country).strip('_')+'.png')
+
+# Owns one figure with an axes per metric, reused for every page drawn through it
+# matplotlib is only imported once a figure is made
+class ReportContext(object):
+  def __init__(self, titles, figsize=(11,8.5)):
+    import matplotlib.figure
+    import matplotlib.ticker
+    self.figure = matplotlib.figure.Figure(figsize=figsize)
+    nColumns = int(np.ceil(np.sqrt(len(titles))))
+    nRows = int(np.ceil(len(titles)/float(nColumns)))
+    self.axes = []
+    self.lines = []
+    for iMetric, title in enumerate(titles):
+      axes = self.figure.add_subplot(nRows, nColumns, iMetric+1)
+      axes.set_title(title, fontsize=10)
+      axes.tick_params(labelsize=8)
+      # Few ticks per small plot, as tick labels are most of the time to draw a page
+      axes.yaxis.set_major_locator(matplotlib.ticker.MaxNLocator(5))
+      self.axes.append(axes)
+      self.lines.append(axes.plot([], [], color='blue', linestyle='solid')[0])
+    self.title = self.figure.suptitle('', fontsize=20)
+    self.figure.text(0.5, 0.03, 'Number of days from the first case', ha='center', fontsize=12)
+    self.figure.subplots_adjust(hspace=0.45, wspace=0.3)
+
+  # values[iDay, iMetric] = value iDay days after the first case
+  def draw(self, country, values, nDays):
+    self.title.set_text(country)
+    days = np.arange(nDays)
+    for iMetric, (axes, line) in enumerate(zip(self.axes, self.lines)):
+      cases = values[:nDays, iMetric]
+      line.set_data(days, cases)
+      axes.set_xlim([0, max(nDays, 1)])
+      axes.set_xticks(np.arange(0, nDays+1, step=tickStep(nDays, maxTicks=6)))
+      hasData = ~np.isnan(cases)
+      if hasData.any():
+        minEntry, maxEntry = cases[hasData].min(), cases[hasData].max()
+        axes.set_ylim([min(minEntry, 0), maxEntry*1.1 if maxEntry > 0 else 1])
+      else: axes.set_ylim([0, 1])
+
+  def close(self):
+    self.figure.clear()
+    self.axes, self.lines = [], []
+
+# Draws the pages of countries into one multi-page pdf (filename ending in .pdf) or a png per country in folder filename
+# Returns (files, seconds, stages) with the stages recorded by profiling in a worker process (collectStages)
+def renderChunk(countries, values, nDays, titles, filename, collectStages=False):
+  startTime = time.time()
+  files = []
+  context = ReportContext(titles)
+  with profiling.stage('report') as timer:
+    if filename.endswith('.pdf'):
+      from matplotlib.backends.backend_pdf import PdfPages
+      with PdfPages(filename) as pdf:
+        for iCountry, country in enumerate(countries):
+          context.draw(country, values[iCountry], nDays[iCountry])
+          pdf.savefig(context.figure)
+      files.append(filename)
+    else:
+      for iCountry, country in enumerate(countries):
+        context.draw(country, values[iCountry], nDays[iCountry])
+        files.append(pageFilename(filename, country))
+        context.figure.savefig(files[-1])
+    timer.add(pages=len(countries))
+  context.close()
+  return files, time.time()-startTime, profiling.takeStages() if collectStages else {}
+
+# Makes a page per country, for countries in interestedCountries (all when empty) and not in ignoreCountries,
+# ordered by their latest value of sortIndex. Pages go to a multi-page pdf when filename ends in .pdf,
+# otherwise to a png per country in the folder filename.
+# With jobs > 1 the pngs are drawn in chunks of countries on jobs processes. A pdf is always one file drawn
+# in this process, as its pages cannot be written by several processes.
+# Returns the written files
+def makeReport(data, filename, interestedCountries=[], ignoreCountries=defaultIgnoreCountries, sortIndex=4, jobs=1):
+  startTime = time.time()
+  countries = selectCountries(data, interestedCountries, ignoreCountries, sortIndex)
+  metrics = reportMetrics(data)
+  titles = [allMetricNames[iMetric] for iMetric in metrics]
+  with profiling.stage('alignReport') as timer:
+    values, nDays = alignReport(data, countries, metrics)
+    timer.add(countries=len(countries))
+  isPdf = filename.endswith('.pdf')
+  if not isPdf and not os.path.exists(filename): os.makedirs(filename)
+
+  # pngs get several chunks per process so processes finish together
+  nChunks = min(4*jobs, max(len(countries), 1)) if jobs > 1 and not isPdf else 1
+  bounds = np.linspace(0, len(countries), nChunks+1).astype(int)
+  chunks = []
+  for iChunk in range(nChunks):
+    start, end = bounds[iChunk], bounds[iChunk+1]
+    chunks.append((countries[start:end], values[start:end], nDays[start:end], titles, filename))
+  if nChunks == 1:
+    results = [renderChunk(*chunks[0])]
+  else:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initWorker, initargs=('makeGraphs', profiling.enabled)) as executor:
+      results = list(executor.map(renderChunk, *(list(argument) for argument in zip(*chunks)), [True]*nChunks))
+  files = []
+  for chunkFiles, seconds, stages in results:
+    profiling.mergeStages(stages)
+    files.extend(chunkFiles)
+  print('Made report of %d countries in %d files on %d processes in %.3f s' % (len(countries), len(files), min(jobs, nChunks), time.time()-startTime))
+  return files
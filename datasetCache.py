@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import json
+import os
+import numpy as np
+import profiling
+from timeSeries import TimeSeries, RegionHierarchy, deriveMetrics
+
+# Bump when the layout of TimeSeries or the parsing changes so old caches are rebuilt
+schemaVersion = 4
+
+# A cached dataset is stored as
+#   cachePath+'.cache.json'       = {'schemaVersion', 'sourceHashes': {filename: sha256}, 'countries', 'dates'}
+#                                   and 'hierarchy' = RegionHierarchy.toDict() for region-level data
+#   cachePath+'.cache.values.npy' = TimeSeries.values
+#   cachePath+'.cache.valid.npy'  = TimeSeries.valid
+#   cachePath+'.cache.rows.npy'   = fingerprints of the source rows, when given, with 'rows' = True in the index
+# With 'totalsOnly' = True in the index the arrays hold only (totalCases, totalDeaths, totalRecoveries),
+# and the other metrics are derived again when the cache is loaded
+# The json index is written last so a half-written cache is never used
+def cachePaths(cachePath):
+  return cachePath+'.cache.json', cachePath+'.cache.values.npy', cachePath+'.cache.valid.npy'
+
+def rowsPath(cachePath):
+  return cachePath+'.cache.rows.npy'
+
+def loadCacheIndex(cachePath):
+  indexPath = cachePaths(cachePath)[0]
+  if not os.path.exists(indexPath): return {}
+  with open(indexPath) as inFile:
+    index = json.load(inFile)
+  if index.get('schemaVersion') != schemaVersion: return {}
+  return index
+
+# Returns the cached TimeSeries memory mapped read-only, or None when the cache
+# is missing or was built from other source files (any source when sourceHashes is None)
+# A cache of totals only is loaded into memory with the daily and active metrics derived
+def loadDataset(cachePath, sourceHashes=None):
+  index = loadCacheIndex(cachePath)
+  if len(index) == 0 or (sourceHashes is not None and index.get('sourceHashes') != sourceHashes): return None
+  indexPath, valuesPath, validPath = cachePaths(cachePath)
+  try:
+    with profiling.stage('loadCache') as timer:
+      values = np.load(valuesPath, mmap_mode='r')
+      valid = np.load(validPath, mmap_mode='r')
+      timer.add(cells=values.size)
+  except (IOError, ValueError):
+    return None
+  if values.shape != (len(index['countries']), len(index['dates']), values.shape[2]) or valid.shape != values.shape: return None
+  if index.get('totalsOnly', False) and values.shape[2] != 3: return None
+  print('Loaded cached data from '+indexPath)
+  if index.get('totalsOnly', False):
+    data = TimeSeries(index['countries'], np.array(index['dates'], dtype='datetime64[D]'))
+    with profiling.stage('derive') as timer:
+      data.values[:, :, 3:6] = values
+      # A daily metric has data where its total has, active cases where both cases and recoveries have
+      data.valid[:, :, 0:3] = valid
+      data.valid[:, :, 3:6] = valid
+      data.valid[:, :, 6] = valid[:, :, 0] & valid[:, :, 2]
+      timer.add(cells=deriveMetrics(data).size)
+  else:
+    data = TimeSeries(index['countries'], np.array(index['dates'], dtype='datetime64[D]'), values, valid)
+  data.sourceHashes = index['sourceHashes']
+  if 'hierarchy' in index: data.hierarchy = RegionHierarchy.fromDict(index['hierarchy'])
+  return data
+
+# Fingerprints of the source rows saved with the dataset, None when there are none
+def loadRows(cachePath):
+  if not loadCacheIndex(cachePath).get('rows', False): return None
+  try:
+    return np.load(rowsPath(cachePath))
+  except (IOError, ValueError):
+    return None
+
+# rows is a numpy array describing the source rows, for loaders that update the cache from changed rows only
+# totalsOnly saves only the totals, for data whose other metrics are derived from them with deriveMetrics
+def saveDataset(data, cachePath, sourceHashes, rows=None, totalsOnly=False):
+  indexPath, valuesPath, validPath = cachePaths(cachePath)
+  # Remove the index first so readers never pair it with new arrays
+  if os.path.exists(indexPath): os.remove(indexPath)
+  with profiling.stage('saveCache') as timer:
+    metrics = slice(3, 6) if totalsOnly else slice(None)
+    arrays = [(valuesPath, data.values[:, :, metrics]), (validPath, data.valid[:, :, metrics])]
+    if rows is not None: arrays.append((rowsPath(cachePath), rows))
+    for path, array in arrays:
+      with open(path+'.part','wb') as outFile:
+        np.save(outFile, np.ascontiguousarray(array))
+      os.replace(path+'.part', path)
+      timer.add(bytesWritten=array.nbytes)
+  index = {
+      'schemaVersion': schemaVersion,
+      'sourceHashes': sourceHashes,
+      'countries': data.countries,
+      'dates': [str(date) for date in data.dateAxis],
+      }
+  if data.hierarchy is not None: index['hierarchy'] = data.hierarchy.toDict()
+  if rows is not None: index['rows'] = True
+  if totalsOnly: index['totalsOnly'] = True
+  with open(indexPath+'.part','w') as outFile:
+    json.dump(index, outFile)
+  os.replace(indexPath+'.part', indexPath)
+  data.sourceHashes = sourceHashes
+  print('Saving cached data to '+indexPath)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import numpy as np
+
+# Reduces the points of a line before it is drawn, keeping its shape
+# A line of cases[day] is drawn with at most maxPoints points, so the time to draw it and the size of the plot
+# do not grow with the number of days. The first and last days are always kept.
+
+# Indices of at most maxPoints points chosen by largest-triangle-three-buckets
+# The days between the first and last are split in maxPoints-2 buckets. From each bucket the point making the largest
+# triangle with the point kept from the previous bucket and the average of the next bucket is kept, which keeps peaks.
+def largestTriangleThreeBuckets(cases, maxPoints):
+  nPoints = len(cases)
+  if maxPoints >= nPoints or maxPoints < 3: return np.arange(nPoints)
+  cases = np.asarray(cases, dtype=np.float64)
+  edges = np.linspace(1, nPoints-1, maxPoints-1).astype(np.int64)
+  indices = np.zeros(maxPoints, dtype=np.int64)
+  indices[-1] = nPoints-1
+  kept = 0
+  for iBucket in range(maxPoints-2):
+    start, end = edges[iBucket], edges[iBucket+1]
+    # Average of the next bucket, the last point for the last bucket
+    nextStart, nextEnd = end, edges[iBucket+2] if iBucket+2 < len(edges) else nPoints
+    nextDay, nextCase = (nextStart+nextEnd-1)/2., cases[nextStart:nextEnd].mean()
+    days = np.arange(start, end)
+    areas = np.abs((kept-nextDay)*(cases[start:end]-cases[kept]) - (kept-days)*(nextCase-cases[kept]))
+    kept = start+int(np.argmax(areas))
+    indices[iBucket+1] = kept
+  return indices
+
+# Indices of at most maxPoints points keeping the minimum and maximum of each of maxPoints/2 buckets of days
+def minMaxBuckets(cases, maxPoints):
+  nPoints = len(cases)
+  if maxPoints >= nPoints or maxPoints < 4: return np.arange(nPoints)
+  cases = np.asarray(cases, dtype=np.float64)
+  # Buckets of equal size, the last one padded with the last point
+  nBuckets = (maxPoints-2)//2
+  bucketSize = -(-(nPoints-2)//nBuckets)
+  buckets = np.pad(cases[1:-1], (0, nBuckets*bucketSize-(nPoints-2)), mode='edge').reshape(nBuckets, bucketSize)
+  starts = 1+bucketSize*np.arange(nBuckets)
+  middle = np.minimum(np.concatenate([starts+np.argmin(buckets, axis=1), starts+np.argmax(buckets, axis=1)]), nPoints-2)
+  return np.unique(np.concatenate([[0], middle, [nPoints-1]]))
+
+downsamplers = {'lttb': largestTriangleThreeBuckets, 'minmax': minMaxBuckets}
+
+# Returns (days, cases) of the points of cases to draw, days being the day of each point
+# maxPoints <= 0 keeps every point
+def downsample(cases, maxPoints, method='lttb'):
+  if maxPoints <= 0 or len(cases) <= maxPoints: return np.arange(len(cases)), cases
+  indices = downsamplers[method](cases, maxPoints)
+  return indices, np.asarray(cases)[indices]
+
+# Step between day ticks so there are at most maxTicks ticks: 1, 2, 5, 10, 20, 50, ... days
+def tickStep(maxDays, maxTicks=40):
+  scale = 1
+  while True:
+    for step in [scale, 2*scale, 5*scale]:
+      if -(-(maxDays+1)//step) <= maxTicks: return step
+    scale *= 10
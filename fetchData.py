@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+try:
+  import httplib
+  from urlparse import urlparse, urljoin
+except:
+  import http.client as httplib
+  from urllib.parse import urlparse, urljoin
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import profiling
+
+# Validators of a saved download are kept next to it
+# validators = {'url', 'etag', 'lastModified', 'sha256'}
+def validatorPath(filepath):
+  return filepath+'.fetch.json'
+
+def loadValidators(filepath):
+  if not os.path.exists(filepath) or not os.path.exists(validatorPath(filepath)): return {}
+  with open(validatorPath(filepath)) as inFile:
+    return json.load(inFile)
+
+def saveValidators(filepath, validators):
+  with open(validatorPath(filepath),'w') as outFile:
+    json.dump(validators, outFile, indent=2, sort_keys=True)
+
+def hashFile(filepath):
+  sha = hashlib.sha256()
+  with open(filepath,'rb') as inFile:
+    for block in iter(lambda: inFile.read(1<<20), b''):
+      sha.update(block)
+  return sha.hexdigest()
+
+# Idle keep-alive connections shared by all fetch threads
+# idleConnections[(scheme, host)] = [HTTPConnection]
+idleConnections = collections.defaultdict(list)
+connectionLock = threading.Lock()
+
+def acquireConnection(scheme, host, timeout):
+  with connectionLock:
+    if len(idleConnections[(scheme, host)]) != 0: return idleConnections[(scheme, host)].pop()
+  connectionClass = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+  return connectionClass(host, timeout=timeout)
+
+def releaseConnection(scheme, host, connection):
+  with connectionLock:
+    idleConnections[(scheme, host)].append(connection)
+
+# GET url on a pooled keep-alive connection, following redirects
+# Returns (status, headers, body) with body already decompressed
+def request(url, headers={}, timeout=60, redirects=5):
+  parsedUrl = urlparse(url)
+  path = parsedUrl.path + ('?'+parsedUrl.query if parsedUrl.query else '')
+  headers = dict(headers, **{'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+  # Retry once on a fresh connection in case the server closed the pooled one
+  for attempt in range(2):
+    connection = acquireConnection(parsedUrl.scheme, parsedUrl.netloc, timeout)
+    try:
+      connection.request('GET', path, headers=headers)
+      response = connection.getresponse()
+      body = response.read()
+      break
+    except (httplib.HTTPException, socket.error):
+      connection.close()
+      if attempt == 1: raise
+  if response.getheader('Connection', '').lower() == 'close' or response.version == 10: connection.close()
+  else: releaseConnection(parsedUrl.scheme, parsedUrl.netloc, connection)
+  if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+    return request(urljoin(url, response.getheader('Location')), headers, timeout, redirects-1)
+  if response.getheader('Content-Encoding', '') == 'gzip': body = gzip.decompress(body)
+  return response.status, response, body
+
+# Downloads url to filepath with a conditional request
+# Returns (changed, sha256): changed is False when upstream answered 304
+# or sent a body identical to the saved file, in which case the file is not rewritten
+def fetchUrl(url, filepath, timeout=60):
+  validators = loadValidators(filepath)
+  # Files saved without validators can still be matched by content
+  if validators.get('url') != url: validators = {'sha256': hashFile(filepath)} if os.path.exists(filepath) else {}
+  headers = {}
+  if 'etag' in validators: headers['If-None-Match'] = validators['etag']
+  if 'lastModified' in validators: headers['If-Modified-Since'] = validators['lastModified']
+
+  with profiling.stage('fetch') as timer:
+    status, response, body = request(url, headers, timeout)
+    timer.add(files=1, bytesFetched=len(body))
+  if status == 304:
+    print('Unchanged '+url+' (not modified)')
+    return False, validators['sha256']
+  if status != 200: raise IOError('Failed to fetch '+url+': HTTP '+str(status))
+  sha256 = hashlib.sha256(body).hexdigest()
+  newValidators = {'url': url, 'sha256': sha256}
+  if response.getheader('ETag'): newValidators['etag'] = response.getheader('ETag')
+  if response.getheader('Last-Modified'): newValidators['lastModified'] = response.getheader('Last-Modified')
+
+  changed = validators.get('sha256') != sha256
+  if changed:
+    print('Saving '+url+' to '+filepath)
+    # Write to a temporary file first so an interrupted download never leaves a partial csv
+    with open(filepath+'.part','wb') as outFile:
+      outFile.write(body)
+    os.replace(filepath+'.part', filepath)
+  else:
+    print('Unchanged '+url+' (same content)')
+  saveValidators(filepath, newValidators)
+  return changed, sha256
+
+# Fetches urls concurrently and parses each file as soon as its own download finishes
+# parse(filepath, sha256) is called in the worker thread; None skips parsing
+# Returns [(changed, sha256, parsed)] in the order of urls
+def fetchAll(urls, filepaths, parse=None, jobs=None, timeout=60):
+  def fetchAndParse(url, filepath):
+    startTime = time.time()
+    changed, sha256 = fetchUrl(url, filepath, timeout)
+    fetchTime = time.time()
+    parsed = None if parse is None else parse(filepath, sha256)
+    print('%s: fetch %.3f s, parse %.3f s' % (os.path.basename(filepath), fetchTime-startTime, time.time()-fetchTime))
+    return changed, sha256, parsed
+
+  startTime = time.time()
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or len(urls)) as executor:
+    futures = [executor.submit(fetchAndParse, url, filepath) for url, filepath in zip(urls, filepaths)]
+    results = [future.result() for future in futures]
+  print('Fetched %d files in %.3f s' % (len(urls), time.time()-startTime))
+  return results
@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+import concurrent.futures
+import csv
+import re
+import os
+import datetime
+import time
+import warnings
+import zlib
+import numpy as np
+import profiling
+from timeSeries import TimeSeries, RegionHierarchy, regionName, rollUpRegions, deriveMetrics, mergeTimeSeries, toDatetime64
+from fetchData import fetchUrl, fetchAll, hashFile
+from datasetCache import loadCacheIndex, loadDataset, loadRows, saveDataset
+
+# Data parsed in this process, keyed on file path(s), with the sha256 of the content it was parsed from
+# parsedData[filepath] = (sha256, data)
+parsedData = {}
+
+# Countries that appear under several names in John Hopkins data
+combineCountries = {
+    'China': ['Mainland China'],
+    'South Korea':['Korea, South', 'Republic of Korea'],
+    'Taiwan':['Taiwan*'],
+    }
+countryAliases = dict((alias, country) for country in combineCountries for alias in combineCountries[country])
+
+# Countries named differently by World in Data and John Hopkins, under their World in Data name
+combineSources = {
+    'United States': ['US'],
+    'Czech Republic': ['Czechia'],
+    'Iran': ['Iran (Islamic Republic of)'],
+    'Vietnam': ['Viet Nam'],
+    'Russia': ['Russian Federation'],
+    'Macedonia': ['North Macedonia'],
+    'Moldova': ['Republic of Moldova'],
+    'Palestine': ['occupied Palestinian territory', 'West Bank and Gaza'],
+    'Democratic Republic of Congo': ['Congo (Kinshasa)'],
+    'Cape Verde': ['Cabo Verde'],
+    'Vatican': ['Holy See'],
+    'Hong Kong': ['Hong Kong SAR'],
+    'Macao': ['Macao SAR', 'Macau'],
+    }
+sourceAliases = dict((alias, country) for country in combineSources for alias in combineSources[country])
+
+# Matches Province/State,Country/Region,Latitude,Longitude, at the start of a row
+headPattern = re.compile(r'(?:"[^"]*"|[^,"]*),(?:"[^"]*"|[^,"]*),[^,]*,[^,]*,')
+
+# World in Data columns (new_cases, new_deaths, total_cases, total_deaths) -> index in data
+worldInDataMetrics = [0, 1, 3, 4]
+
+# Source urls
+worldInDataUrl = 'http://cowid.netlify.com/data/full_data.csv'
+johnHopkinsUrls = [
+    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Confirmed.csv",
+    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Deaths.csv",
+    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Recovered.csv",
+    ]
+
+# Paths of the downloaded source files of dataType (WorldInData, JohnHopkins or Merged)
+def sourceFiles(dataType, dataFolder='./', tag=''):
+  urls = {'WorldInData': [worldInDataUrl], 'JohnHopkins': johnHopkinsUrls, 'Merged': [worldInDataUrl]+johnHopkinsUrls}[dataType]
+  return [os.path.join(dataFolder, tag+os.path.basename(url)) for url in urls]
+
+# John Hopkins file name -> index in data
+johnHopkinsMetrics = [('time_series_19-covid-Confirmed', 3), ('time_series_19-covid-Deaths', 4), ('time_series_19-covid-Recovered', 5)]
+
+# Blocks that np.fromstring cannot read to the end are detected from the number of decoded cells
+# Older numpy warns about them from any thread, so the warning is silenced once for the process
+warnings.filterwarnings('ignore', message='string or file could not be read', category=DeprecationWarning)
+
+# Converts a block of csv rows to int64, with empty cells as 0
+# tails[iRow] = 'case,case,...' for the date columns of a row
+def decodeCases(tails, nDates):
+  text = ','.join(tails)
+  # Fast path: one C-level parse of the whole block
+  if ',,' not in text and not text.startswith(',') and not text.endswith(',') and '.' not in text:
+    # Newer numpy raises on a block it cannot read to the end
+    try:
+      cases = np.fromstring(text, dtype=np.int64, sep=',')
+    except ValueError:
+      cases = None
+    if cases is not None and len(cases) == len(tails)*nDates: return cases.reshape(len(tails), nDates)
+  cells = np.array([tail.split(',') for tail in tails])
+  cells[cells == ''] = '0'
+  return cells.astype(np.float64).astype(np.int64)
+
+# Latitude or longitude, nan when missing
+def parseCoordinate(text):
+  try: return float(text)
+  except ValueError: return float('nan')
+
+# Decodes tails into cases[start:], growing cases when full
+def storeCases(cases, start, tails):
+  while start+len(tails) > len(cases): cases = np.concatenate([cases, np.zeros_like(cases)])
+  cases[start:start+len(tails)] = decodeCases(tails, cases.shape[1])
+  return cases
+
+# Metric of a John Hopkins file, from its name
+def metricOfFile(inFilePath):
+  filename = os.path.basename(inFilePath)
+  return [index for name, index in johnHopkinsMetrics if name in filename][0]
+
+# crc32 of the date cells of a John Hopkins header line
+def headerHash(header):
+  return zlib.crc32(header.rstrip('\r\n').split(',', 4)[-1].encode())
+
+# Fingerprints of the rows of the John Hopkins files, saved with the region cache so a later --incremental run
+# only decodes what changed. For each file, in file order:
+#   (file, -1, 0, crc32 of the header dates), only when the file had exactly the dates of the region data, in order
+#   (file, region, crc32 of the leading columns, crc32 of the date cells) for each row
+# with file = index of the file in johnHopkinsUrls and region = row of the region data
+johnHopkinsRowType = np.dtype([('file', np.int8), ('region', np.int32), ('head', np.uint32), ('crc', np.uint32)])
+
+# Streams a wide John Hopkins csv into a preallocated array
+# inFile = [Province/State,Country/Region,Latitude,Longitude, CasesForDate...]
+# Only the four leading columns go through csv; the numeric tail of each row is decoded in blocks.
+# Returns (iMetric, regions, dates, cases, hashes, datesHash) with regions[iRow] = (region, country, latitude, longitude),
+# cases[iRow, iDate] = case, hashes[iRow] = (crc32 of the leading columns, crc32 of the date cells) and
+# datesHash = crc32 of the header dates
+def parseJohnHopkinsFile(inFilePath, chunkSize=1024):
+  startTime = time.time()
+  # Resolve metric once per file
+  filename = os.path.basename(inFilePath)
+  iMetric = metricOfFile(inFilePath)
+  regions = []
+  hashes = []
+  with open(inFilePath) as inFile:
+    # Parse dates once from header
+    header = next(inFile)
+    datesHash = headerHash(header)
+    dates = [datetime.datetime.strptime(date,'%m/%d/%y') for date in next(csv.reader([header]))[4:]]
+    nDates = len(dates)
+    cases = np.zeros((chunkSize, nDates), dtype=np.int64)
+    tails = []
+    for line in inFile:
+      line = line.rstrip('\r\n')
+      if line == '': continue
+      head = headPattern.match(line)
+      tail = line[head.end():] if head else ''
+      # Rows with missing dates: parse fully and pad
+      if head is None or tail.count(',') != nDates-1:
+        row = next(csv.reader([line]))
+        row = row + ['']*(4+nDates-len(row))
+        regions.append((row[0], countryAliases.get(row[1], row[1]), parseCoordinate(row[2]), parseCoordinate(row[3])))
+        tails.append(','.join(row[4:4+nDates]))
+        # Never matched by scanJohnHopkinsFile, which parses such files in full
+        hashes.append((0, 0))
+      else:
+        region, country, latitude, longitude = next(csv.reader([line[:head.end()-1]]))
+        regions.append((region, countryAliases.get(country, country), parseCoordinate(latitude), parseCoordinate(longitude)))
+        tails.append(tail)
+        hashes.append((zlib.crc32(line[:head.end()].encode()), zlib.crc32(tail.encode())))
+      # Decode full chunks straight into the array
+      if len(tails) == chunkSize:
+        cases = storeCases(cases, len(regions)-len(tails), tails)
+        tails = []
+    if len(tails) != 0: cases = storeCases(cases, len(regions)-len(tails), tails)
+  cases = cases[:len(regions)]
+
+  elapsed = time.time() - startTime
+  print('Parsed %d rows x %d dates from %s in %.3f s (%.0f rows/s)' % (len(regions), nDates, filename, elapsed, len(regions)/max(elapsed, 1e-9)))
+  return iMetric, regions, dates, cases, np.array(hashes, dtype=np.uint32).reshape(len(regions), 2), datesHash
+
+# Reads a John Hopkins file against the fingerprints of its rows in the cache (rows, as johnHopkinsRowType)
+# Only the header dates after storedDates are parsed and only their columns decoded, plus every column of the
+# rows whose older cells changed and of the rows where alwaysRevised[iRow] is True.
+# Returns None when the file needs a full parse: older dates changed, rows added, removed or renamed, or a row with missing cells.
+# Otherwise returns (newDates, newCases, revisedRows, revisedCases, hashes, datesHash) with newCases[iRow, iNewDate] = case,
+# revisedCases[iRevised, iDate] = case of row revisedRows[iRevised] for all dates of the file and hashes[iRow] = crc32 of the date cells
+def scanJohnHopkinsFile(inFilePath, storedDates, rows, alwaysRevised=None):
+  nStored = len(storedDates)
+  if nStored == 0 or len(rows) == 0 or rows['region'][0] != -1: return None
+  storedDatesHash, rows = rows['crc'][0], rows[1:]
+  with open(inFilePath) as inFile:
+    header = next(inFile).rstrip('\r\n').split(',', 4)
+    if len(header) != 5: return None
+    nDates = header[4].count(',')+1
+    nNew = nDates-nStored
+    if nNew < 0: return None
+    storedHeader = header[4].rsplit(',', nNew)[0] if nNew != 0 else header[4]
+    if zlib.crc32(storedHeader.encode()) != storedDatesHash: return None
+    newDates = [datetime.datetime.strptime(date,'%m/%d/%y') for date in header[4][len(storedHeader)+1:].split(',')] if nNew != 0 else []
+    newTails, revisedRows, revisedTails, hashes = [], [], [], []
+    for line in inFile:
+      line = line.rstrip('\r\n')
+      if line == '': continue
+      iRow = len(hashes)
+      head = headPattern.match(line)
+      if head is None or iRow == len(rows): return None
+      tail = line[head.end():]
+      if tail.count(',') != nDates-1 or zlib.crc32(line[:head.end()].encode()) != rows['head'][iRow]: return None
+      # Cells of the stored dates and of the new dates
+      storedTail = tail.rsplit(',', nNew)[0] if nNew != 0 else tail
+      if nNew != 0: newTails.append(tail[len(storedTail)+1:])
+      hashes.append(zlib.crc32(tail.encode()))
+      if zlib.crc32(storedTail.encode()) != rows['crc'][iRow] or (alwaysRevised is not None and alwaysRevised[iRow]):
+        revisedRows.append(iRow)
+        revisedTails.append(tail)
+  if len(hashes) != len(rows): return None
+  newCases = decodeCases(newTails, nNew) if nNew != 0 else np.zeros((len(rows), 0), dtype=np.int64)
+  revisedCases = decodeCases(revisedTails, nDates) if len(revisedTails) != 0 else np.zeros((0, nDates), dtype=np.int64)
+  return newDates, newCases, np.array(revisedRows, dtype=np.intp), revisedCases, np.array(hashes, dtype=np.uint32), zlib.crc32(header[4].encode())
+
+# Parses a John Hopkins file unless the same content was already parsed
+def parseJohnHopkinsFileCached(inFilePath, sha256):
+  if parsedData.get(inFilePath, (None,))[0] != sha256:
+    with profiling.stage('parseJohnHopkins') as timer:
+      parsedData[inFilePath] = (sha256, parseJohnHopkinsFile(inFilePath))
+      timer.add(files=1, rows=len(parsedData[inFilePath][1][1]), cells=parsedData[inFilePath][1][3].size)
+  return parsedData[inFilePath][1]
+
+# Logs which countries and dates an incremental update changed
+def printChanges(data, changedCells):
+  if not changedCells.any(): print('No changed cells')
+  for iCountry in np.flatnonzero(changedCells.any(axis=1)):
+    dates = data.dateAxis[changedCells[iCountry]]
+    if len(dates) <= 3: print('Updated '+data.countries[iCountry]+': '+', '.join(str(date) for date in dates))
+    else: print('Updated '+data.countries[iCountry]+': %d dates from %s to %s' % (len(dates), dates[0], dates[-1]))
+
+# Fingerprints of the rows of a World in Data file, saved with the cache so a later --incremental run only parses changed rows
+# rows[iRow] = (country: row of the data, date: column of the data, crc: crc32 of the csv line)
+worldInDataRowType = np.dtype([('country', np.int32), ('date', np.int32), ('key', np.uint64), ('hash', np.uint64)])
+
+# 64 bit hashes of byte strings, crc32 and adler32 side by side
+def lineHashes(lines):
+  crcs = np.fromiter(map(zlib.crc32, lines), dtype=np.uint64, count=len(lines))
+  adlers = np.fromiter(map(zlib.adler32, lines), dtype=np.uint64, count=len(lines))
+  return (crcs << np.uint64(32)) | adlers
+
+# Returns (keys, hashes) of World in Data lines, keys[iLine] = hash of the date and location of the line
+# and hashes[iLine] = hash of the whole line
+# The last four columns are numbers, so the key is everything before them even when the location is quoted
+def worldInDataKeys(lines):
+  return lineHashes([line.rsplit(b',', 4)[0] for line in lines]), lineHashes(lines)
+
+# Dates of World in Data rows, each distinct date string parsed once
+def parseWorldInDataDates(dateStrings):
+  dateCache = {}
+  for dateString in dateStrings:
+    if dateString not in dateCache: dateCache[dateString] = datetime.datetime.strptime(dateString,'%Y-%m-%d')
+  return dateCache
+
+# Builds data from the lines of a World in Data file, without the header
+# Returns (data, rows) with rows the fingerprints of the lines as worldInDataRowType
+def buildWorldInData(lines):
+  # Collect rows from file
+  # lines[iRow] = b'date,location,new_cases,new_deaths,total_cases,total_deaths'
+  with profiling.stage('parseWorldInData') as timer:
+    rows = [(country, dateString, newCases, newDeaths, totalCases, totalDeaths) for dateString, country, newCases, newDeaths, totalCases, totalDeaths in csv.reader(b'\n'.join(lines).decode('utf-8').split('\n'))] if len(lines) != 0 else []
+    # Dates repeat for every country so parse each only once
+    dateCache = parseWorldInDataDates(set(row[1] for row in rows))
+    timer.add(files=1, rows=len(rows), datesParsed=len(dateCache))
+
+  # Fill store
+  # data.values[iCountry, iDate] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
+  # Recoveries are not provided so they stay invalid (None)
+  with profiling.stage('buildTimeSeries') as timer:
+    data = TimeSeries(sorted(set(row[0] for row in rows)), sorted(dateCache.values()))
+    data.valid[:] = False
+    fingerprints = np.zeros(len(rows), dtype=worldInDataRowType)
+    fingerprints['country'] = [data.countryIndex[row[0]] for row in rows]
+    fingerprints['date'] = [data.dateIndex[dateCache[row[1]]] for row in rows]
+    fingerprints['key'], fingerprints['hash'] = worldInDataKeys(lines)
+    setWorldInDataRows(data, fingerprints, rows)
+    timer.add(cells=data.values.size)
+  return data, fingerprints
+
+# Writes rows at the cells of their fingerprints
+def setWorldInDataRows(data, fingerprints, rows):
+  if len(rows) == 0: return
+  countryIndices, dateIndices = fingerprints['country'][:, None], fingerprints['date'][:, None]
+  data.values[countryIndices, dateIndices, worldInDataMetrics] = decodeCases([','.join(row[2:]) for row in rows], len(worldInDataMetrics))
+  data.valid[countryIndices, dateIndices, worldInDataMetrics] = True
+
+# Updates cached World in Data data with the lines of a file
+# Lines are matched to the cached rows by their date and location, and a line whose hash differs from the hash of
+# the cached row with the same date and location is revised. Only new and revised lines go through csv, and cells of
+# rows that are gone are cleared.
+# Returns (data, rows, changedCells) as buildWorldInData with changedCells[iCountry, iDate] = True for new or revised cells,
+# or None when a country or date lost all its rows or a date and location repeat, which needs a full parse
+def updateWorldInData(lines, stored, storedRows):
+  with profiling.stage('scanWorldInData') as timer:
+    keys, hashes = worldInDataKeys(lines)
+    if len(storedRows) == 0 or len(np.unique(keys)) != len(keys) or len(np.unique(storedRows['key'])) != len(storedRows): return None
+    # matches[iLine] = index of the cached row with the key of the line, -1 for a new line
+    order = np.argsort(storedRows['key'])
+    positions = np.minimum(np.searchsorted(storedRows['key'][order], keys), len(order)-1)
+    matches = np.where(storedRows['key'][order][positions] == keys, order[positions], -1)
+    unchanged = (matches != -1) & (storedRows['hash'][matches] == hashes)
+    changedLines = np.flatnonzero(~unchanged)
+    # Cached rows of unchanged lines are kept, rows of revised lines are replaced and the others are gone
+    kept = np.zeros(len(storedRows), dtype=bool)
+    kept[matches[unchanged]] = True
+    gone = np.ones(len(storedRows), dtype=bool)
+    gone[matches[matches != -1]] = False
+    rows = [(country, dateString, newCases, newDeaths, totalCases, totalDeaths) for dateString, country, newCases, newDeaths, totalCases, totalDeaths in csv.reader(lines[iLine].decode('utf-8') for iLine in changedLines)]
+    dateCache = parseWorldInDataDates(set(row[1] for row in rows))
+    timer.add(rows=len(lines), changedRows=len(rows), removedRows=int(gone.sum()))
+
+  with profiling.stage('merge') as timer:
+    countries = sorted(set(stored.countries) | set(row[0] for row in rows))
+    dateAxis = np.union1d(stored.dateAxis, np.array([toDatetime64(date) for date in dateCache.values()], dtype='datetime64[D]'))
+    if countries == stored.countries and len(dateAxis) == len(stored.dates):
+      data = TimeSeries(countries, dateAxis, np.array(stored.values), np.array(stored.valid))
+      countryMap, dateMap = np.arange(len(countries)), np.arange(len(dateAxis))
+    else:
+      # New countries or dates: place the stored block into larger arrays
+      data = TimeSeries(countries, dateAxis)
+      data.valid[:] = False
+      countryMap = np.array([data.countryIndex[country] for country in stored.countries], dtype=np.intp)
+      dateMap = np.searchsorted(dateAxis, stored.dateAxis)
+      data.values[np.ix_(countryMap, dateMap)] = stored.values
+      data.valid[np.ix_(countryMap, dateMap)] = stored.valid
+    fingerprints = np.zeros(len(storedRows), dtype=worldInDataRowType)
+    fingerprints['country'], fingerprints['date'] = countryMap[storedRows['country']], dateMap[storedRows['date']]
+    fingerprints['key'], fingerprints['hash'] = storedRows['key'], storedRows['hash']
+    changedCells = np.zeros((len(countries), len(dateAxis)), dtype=bool)
+    # Rows that are gone
+    removed = fingerprints[gone]
+    data.values[removed['country'][:, None], removed['date'][:, None], worldInDataMetrics] = 0
+    data.valid[removed['country'][:, None], removed['date'][:, None], worldInDataMetrics] = False
+    changedCells[removed['country'], removed['date']] = True
+    # New and revised rows
+    newRows = np.zeros(len(rows), dtype=worldInDataRowType)
+    newRows['country'] = [data.countryIndex[row[0]] for row in rows]
+    newRows['date'] = [data.dateIndex[dateCache[row[1]]] for row in rows]
+    newRows['key'], newRows['hash'] = keys[changedLines], hashes[changedLines]
+    setWorldInDataRows(data, newRows, rows)
+    changedCells[newRows['country'], newRows['date']] = True
+    fingerprints = np.concatenate([fingerprints[kept], newRows])
+    timer.add(changedCells=int(changedCells.sum()))
+  # A full parse drops countries and dates without rows
+  if len(np.unique(fingerprints['country'])) != len(countries) or len(np.unique(fingerprints['date'])) != len(dateAxis): return None
+  return data, fingerprints, changedCells
+
+# fetch=False uses the files already in dataFolder, parse=False only downloads and returns None
+# incremental=True only parses the rows that changed since the cache was written
+def getDataFromWorldInData(dataFolder='./', tag='', incremental=False, fetch=True, parse=True):
+  if not os.path.exists(dataFolder): os.makedirs(dataFolder)
+  confirmedUrl = worldInDataUrl
+  filepath = sourceFiles('WorldInData', dataFolder, tag)[0]
+
+  # Gets data from url if it changed
+  if fetch: changed, sha256 = fetchUrl(confirmedUrl, filepath)
+  else: sha256 = hashFile(filepath)
+  if not parse: return None
+  # Reuse data parsed from identical content, in this process or cached on disk
+  if parsedData.get(filepath, (None,))[0] == sha256: return parsedData[filepath][1]
+  sourceHashes = {os.path.basename(filepath): sha256}
+  data = loadDataset(filepath, sourceHashes)
+  if data is not None:
+    parsedData[filepath] = (sha256, data)
+    return data
+
+  # Lines of the file without the header
+  with open(filepath, 'rb') as inFile:
+    lines = inFile.read().splitlines()[1:]
+  # Only parse what changed from the stored data
+  updated = None
+  if incremental:
+    stored = loadDataset(filepath)
+    storedRows = loadRows(filepath)
+    if stored is not None and storedRows is not None: updated = updateWorldInData(lines, stored, storedRows)
+  if updated is not None:
+    data, rows, changedCells = updated
+    printChanges(data, changedCells)
+  else:
+    data, rows = buildWorldInData(lines)
+
+  saveDataset(data, filepath, sourceHashes, rows=rows)
+  parsedData[filepath] = (sha256, data)
+  return data
+
+# Builds the region-level data of parsed John Hopkins files and rolls it up to countries
+# Returns (data, regionData, rows) with rows the fingerprints of the file rows, as johnHopkinsRowType
+def buildJohnHopkins(parsed):
+  # Keep every Province/State as its own row
+  # regionData.values[iRegion, iDate] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
+  with profiling.stage('buildTimeSeries') as timer:
+    regionInfo = {}
+    for iMetric, regions, dates, cases, hashes, datesHash in parsed:
+      for region, country, latitude, longitude in regions:
+        regionInfo.setdefault(regionName(region, country), (country, latitude, longitude))
+    names = sorted(regionInfo)
+    regionData = TimeSeries(names, sorted(set(date for iMetric, regions, dates, cases, hashes, datesHash in parsed for date in dates)))
+    regionData.hierarchy = RegionHierarchy(names, [regionInfo[name][0] for name in names], [regionInfo[name][1] for name in names], [regionInfo[name][2] for name in names], countryAliases)
+    rows = []
+    for iFile, (iMetric, regions, dates, cases, hashes, datesHash) in enumerate(parsed):
+      regionIndices = np.array([regionData.countryIndex[regionName(region, country)] for region, country, latitude, longitude in regions], dtype=np.intp)
+      dateIndices = np.array([regionData.dateIndex[date] for date in dates], dtype=np.intp)
+      totals = np.zeros((len(names), len(dates)), dtype=np.int64)
+      # Rows repeated in a file are summed
+      if len(np.unique(regionIndices)) == len(regionIndices): totals[regionIndices] = cases
+      else: np.add.at(totals, regionIndices, cases)
+      regionData.values[:, dateIndices, iMetric] = totals
+      fileRows = np.zeros(len(regions)+1, dtype=johnHopkinsRowType)
+      fileRows['file'] = iFile
+      fileRows['region'] = np.concatenate([[-1], regionIndices])
+      fileRows['head'][1:], fileRows['crc'][1:] = hashes[:, 0], hashes[:, 1]
+      fileRows['crc'][0] = datesHash
+      if not np.array_equal(dateIndices, np.arange(len(regionData.dates))): fileRows = fileRows[1:]
+      rows.append(fileRows)
+    timer.add(cells=regionData.values.size)
+  with profiling.stage('derive') as timer:
+    timer.add(cells=deriveMetrics(regionData).size)
+
+  # Sum regions into countries
+  # data.values[iCountry, iDate] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
+  with profiling.stage('rollUp') as timer:
+    data = rollUpRegions(regionData)
+    timer.add(regions=len(regionData.countries), cells=data.values.size)
+  return data, regionData, np.concatenate(rows) if len(rows) != 0 else np.zeros(0, dtype=johnHopkinsRowType)
+
+# Updates the cached John Hopkins data with the files that changed since it was written
+# Only the dates after the cached ones and the rows whose older cells changed are decoded, and only those
+# dates and the countries of those rows are derived and rolled up again.
+# Returns (data, regionData, rows, changedCells) as buildJohnHopkins with changedCells[iCountry, iDate] = True
+# for new or revised cells, or None when the cache is missing or a file needs a full parse
+def updateJohnHopkins(files, sourceHashes, cachePath):
+  storedRegions = loadDataset(cachePath+'-regions')
+  stored = loadDataset(cachePath)
+  storedRows = loadRows(cachePath+'-regions')
+  if storedRegions is None or stored is None or storedRows is None or storedRegions.hierarchy is None: return None
+  if stored.countries != storedRegions.hierarchy.countries or not np.array_equal(stored.dateAxis, storedRegions.dateAxis): return None
+  nStored = len(storedRegions.dates)
+  fileRows = [np.array(storedRows[storedRows['file'] == iFile]) for iFile in range(len(files))]
+  scans = []
+  with profiling.stage('scanJohnHopkins') as timer:
+    for iFile, inFilePath in enumerate(files):
+      if storedRegions.sourceHashes.get(os.path.basename(inFilePath)) == sourceHashes[os.path.basename(inFilePath)]: continue
+      # Rows repeated in a file are summed, so they are always decoded together
+      regions, inverse, counts = np.unique(fileRows[iFile]['region'][1:], return_inverse=True, return_counts=True)
+      scan = scanJohnHopkinsFile(inFilePath, storedRegions.dateAxis, fileRows[iFile], counts[inverse] > 1)
+      if scan is None: return None
+      scans.append((iFile, scan))
+      timer.add(files=1, newCells=scan[1].size, revisedRows=len(scan[2]))
+  newDates = sorted(set(date for iFile, scan in scans for date in scan[0]))
+  if len(newDates) != 0 and toDatetime64(newDates[0]) <= storedRegions.dateAxis[-1]: return None
+  dateAxis = np.concatenate([storedRegions.dateAxis, np.array([toDatetime64(date) for date in newDates], dtype='datetime64[D]')])
+
+  # Region rows: the stored block, new dates and revised rows
+  with profiling.stage('updateRegions') as timer:
+    hierarchy = storedRegions.hierarchy
+    regionData = TimeSeries(storedRegions.countries, dateAxis)
+    regionData.hierarchy = hierarchy
+    regionData.values[:, :nStored] = storedRegions.values
+    regionData.valid[:, :nStored] = storedRegions.valid
+    revisedRegions = [np.zeros(0, dtype=np.intp)]
+    for iFile, (fileNewDates, newCases, revisedRows, revisedCases, hashes, datesHash) in scans:
+      iMetric = metricOfFile(files[iFile])
+      regionIndices = fileRows[iFile]['region'][1:].astype(np.intp)
+      dateIndices = np.concatenate([np.arange(nStored), np.searchsorted(dateAxis, np.array([toDatetime64(date) for date in fileNewDates], dtype='datetime64[D]'))]).astype(np.intp)
+      newTotals = np.zeros((len(regionData.countries), newCases.shape[1]), dtype=np.int64)
+      np.add.at(newTotals, regionIndices, newCases)
+      regionData.values[:, dateIndices[nStored:], iMetric] = newTotals
+      fileRevisedRegions, inverse = np.unique(regionIndices[revisedRows], return_inverse=True)
+      revisedTotals = np.zeros((len(fileRevisedRegions), len(dateIndices)), dtype=np.int64)
+      np.add.at(revisedTotals, inverse, revisedCases)
+      regionData.values[fileRevisedRegions[:, None], dateIndices[None, :], iMetric] = revisedTotals
+      revisedRegions.append(fileRevisedRegions)
+      fileRows[iFile]['crc'][1:] = hashes
+      fileRows[iFile]['crc'][0] = datesHash
+    # A header keeps its fingerprint only while the file has every date, in order
+    for iFile in range(len(files)):
+      scanned = [scan for jFile, scan in scans if jFile == iFile]
+      fileDates = nStored+len(scanned[0][0]) if len(scanned) != 0 else nStored
+      if fileDates != len(dateAxis) and len(fileRows[iFile]) != 0 and fileRows[iFile]['region'][0] == -1: fileRows[iFile] = fileRows[iFile][1:]
+    revisedRegions = np.unique(np.concatenate(revisedRegions))
+    deriveMetrics(regionData, dateIndices=np.arange(nStored, len(dateAxis)))
+    if len(revisedRegions) != 0:
+      revised = TimeSeries([regionData.countries[iRegion] for iRegion in revisedRegions], dateAxis, regionData.values[revisedRegions])
+      deriveMetrics(revised)
+      regionData.values[revisedRegions] = revised.values
+    timer.add(newDates=len(newDates), revisedRegions=len(revisedRegions))
+
+  # Countries: the stored block, new dates rolled up, and countries of revised rows summed again
+  with profiling.stage('rollUp') as timer:
+    data = TimeSeries(stored.countries, dateAxis)
+    data.values[:, :nStored] = stored.values
+    data.valid[:, :nStored] = stored.valid
+    if len(newDates) != 0:
+      data.values[:, nStored:] = hierarchy.rollUp(regionData.values[:, nStored:])
+      data.valid[:, nStored:] = hierarchy.rollUp(regionData.valid[:, nStored:], np.logical_or)
+    changedCells = np.zeros((len(data.countries), len(dateAxis)), dtype=bool)
+    changedCells[:, nStored:] = True
+    revisedCountries = np.unique(hierarchy.countryOfRegion[revisedRegions])
+    for iCountry in revisedCountries:
+      data.values[iCountry] = regionData.values[hierarchy.countryOfRegion == iCountry].sum(axis=0)
+      changedCells[iCountry, :nStored] = (data.values[iCountry, :nStored, 3:6] != stored.values[iCountry, :, 3:6]).any(axis=1)
+    timer.add(countries=len(revisedCountries))
+  return data, regionData, np.concatenate(fileRows), changedCells
+
+# fetch=False uses the files already in dataFolder, parse=False only downloads and returns None
+# incremental=True decodes only the dates and rows that changed since the cache was written, when the files allow it
+def getDataFromJohnHopkins(dataFolder='./', tag='', jobs=None, incremental=False, fetch=True, parse=True):
+  if not os.path.exists(dataFolder): os.makedirs(dataFolder)
+  # Get time series data
+  links = johnHopkinsUrls
+  files = sourceFiles('JohnHopkins', dataFolder, tag)
+  cachePath = os.path.join(dataFolder, tag+'time_series_19-covid')
+  cachedHashes = loadCacheIndex(cachePath).get('sourceHashes', {})
+  # Incremental runs read changed files against the row fingerprints of the region cache instead of parsing them
+  scanRows = incremental and loadCacheIndex(cachePath+'-regions').get('rows', False)
+  # Files unchanged since the cache was written are only parsed if another file changed
+  def parseFile(inFilePath, sha256):
+    if scanRows or cachedHashes.get(os.path.basename(inFilePath)) == sha256: return None
+    return parseJohnHopkinsFileCached(inFilePath, sha256)
+
+  # Download files concurrently, parsing each one as soon as it arrives
+  if fetch: results = fetchAll(links, files, parse=parseFile if parse else None, jobs=jobs)
+  else: results = [(False, hashFile(inFilePath), None) for inFilePath in files]
+  if not parse: return None
+  hashes = [sha256 for changed, sha256, parsed in results]
+  sourceHashes = dict((os.path.basename(inFilePath), sha256) for inFilePath, sha256 in zip(files, hashes))
+  # Reuse data built from identical content, in this process or cached on disk
+  key = tuple(files)
+  if parsedData.get(key, (None,))[0] == hashes: return parsedData[key][1]
+  data = loadDataset(cachePath, sourceHashes)
+  # Regions are loaded and derived only when they are used, so loading countries stays a memory map
+  if data is not None and loadCacheIndex(cachePath+'-regions').get('sourceHashes') == sourceHashes:
+    data.regions = lambda: loadDataset(cachePath+'-regions', sourceHashes)
+    parsedData[key] = (hashes, data)
+    return data
+
+  updated = updateJohnHopkins(files, sourceHashes, cachePath) if scanRows else None
+  if updated is not None:
+    data, regionData, rows, changedCells = updated
+    printChanges(data, changedCells)
+  else:
+    parsed = [parseJohnHopkinsFileCached(inFilePath, sha256) if parsed is None else parsed for inFilePath, (changed, sha256, parsed) in zip(files, results)]
+    data, regionData, rows = buildJohnHopkins(parsed)
+
+  # Calculate new case and active cases
+  with profiling.stage('derive') as timer:
+    corrections = deriveMetrics(data)
+    timer.add(cells=corrections.size)
+  if corrections.any():
+    print('Negative daily corrections in '+', '.join(data.countries[iCountry] for iCountry in np.flatnonzero(corrections.any(axis=(1,2)))))
+  data.regions = regionData
+
+  # Regions are saved first as the country index marks the cache as complete
+  # Regions only keep their totals, the daily and active metrics are derived again when they are loaded
+  saveDataset(regionData, cachePath+'-regions', sourceHashes, rows=rows, totalsOnly=True)
+  saveDataset(data, cachePath, sourceHashes)
+  parsedData[key] = (hashes, data)
+  return data
+
+# World in Data and John Hopkins data joined on one country index and date axis, with both fetched at once
+# Cells are taken from World in Data where it has them and from John Hopkins otherwise (recoveries, active cases),
+# data.provenance records which one each cell comes from. aliases maps country names of either source to one name.
+def getMergedData(dataFolder='./', tag='', jobs=None, incremental=False, fetch=True, parse=True, aliases=sourceAliases):
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    worldInData = executor.submit(getDataFromWorldInData, dataFolder, tag, incremental, fetch, parse)
+    johnHopkins = executor.submit(getDataFromJohnHopkins, dataFolder, tag, jobs, incremental, fetch, parse)
+    sources = [('WorldInData', worldInData.result()), ('JohnHopkins', johnHopkins.result())]
+  if not parse: return None
+  with profiling.stage('mergeSources') as timer:
+    data = mergeTimeSeries(sources, aliases)
+    timer.add(cells=data.values.size)
+  print('Merged %s into %d countries and %d dates' % (' and '.join(name for name, source in sources), len(data.countries), len(data.dates)))
+  return data
@@ -1,243 +1,144 @@
 #!/usr/bin/env python
-try:
-  import urllib2
-except:
-  import urllib.request as urllib2
-import csv
-import array
-import collections
-import re
+import time
+startTime = time.time()
+import json
 import os
-import glob
 import datetime
 import argparse
-import matplotlib.pyplot as plt
+from getData import getDataFromWorldInData, getDataFromJohnHopkins, getMergedData, sourceFiles
+from snapshotArchive import addSnapshot, restoreSnapshot
+from alignCases import alignCases, defaultIgnoreCountries, defaultMaxExcludeCountry
+from renderPool import renderPlots
+from downsample import downsample, tickStep
+from countryReport import makeReport
+from rollingStatistics import addRollingStatistics, loadPopulation, allMetricNames
+import profiling
 import numpy as np
 
-def drawCases(data, interestedIndex=3, title="Total Cases", filename='totalCases.pdf', dayLimit=-1, lowLimitCase=200, maxCase = -1, interestedCountries=[], ignoreCountries=['Worldwide', 'International conveyance (Diamond Princess)', 'International', 'Others', 'World', 'Cruise Ship'], maxExcludeCountry = ['China']):
-  # Collect interested data depending on rowIndex. Sort country by number of cases
-  # data[country][date] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
-  # interestData[country][date] = case
-  interestData = collections.OrderedDict()
-  for country in sorted(data, key=lambda c: list(data[c].values())[-1][4], reverse=True):
-    # Ignore countries
-    if country in ignoreCountries: continue
-    # Select interested countries
-    if len(interestedCountries) != 0:
-      if country not in interestedCountries: continue
-    # Append interest data
-    for date in data[country]:
-      # Parse case
-      case = data[country][date][interestedIndex]
-      if case == None: continue
-      case = int(case)
-      # Append case
-      if country not in interestData: interestData[country] = collections.OrderedDict()
-      interestData[country][date] = case
-
-  # Convert to plt format
-  # interestDataPlt[country] = ([iDay],[case])
-  interestDataPlt = collections.OrderedDict()
-  for country in interestData:
-    for iDate, date in enumerate(interestData[country]):
-      if country not in interestDataPlt: interestDataPlt[country] = [array.array('d'), array.array('d')]
-      interestDataPlt[country][0].append(iDate)
-      interestDataPlt[country][1].append(interestData[country][date])
+def drawCases(data, interestedIndex=3, title="Total Cases", filename='totalCases.pdf', dayLimit=-1, lowLimitCase=200, maxCase = -1, interestedCountries=[], ignoreCountries=defaultIgnoreCountries, maxExcludeCountry = defaultMaxExcludeCountry, sortIndex=4, maxCountries=-1, maxPoints=0, downsampleMethod='lttb'):
+  # Align countries on the day their daily increase passes lowLimitCase
+  # alignment.series[country] = [case for each day from that day]
+  alignment = alignCases(data, interestedIndex, lowLimitCase, dayLimit=dayLimit, interestedCountries=interestedCountries, ignoreCountries=ignoreCountries, maxExcludeCountry=maxExcludeCountry, sortIndex=sortIndex, maxCountries=maxCountries)
+  drawAlignment(alignment, title=title, filename=filename, lowLimitCase=lowLimitCase, maxCase=maxCase, maxPoints=maxPoints, downsampleMethod=downsampleMethod)
 
+# Owns one figure and axes that are reused for every plot drawn through it
+# Lines are updated in place, so drawing many plots does not grow memory
+# matplotlib is only imported once a figure is made
+class PlotContext(object):
   markers = ['o','v','^','<','>','s','p','*','H','D']
   colors = ['k', 'blue', 'orange', 'green', 'red', 'purple', 'brown', 'pink', 'grey', 'olive', 'cyan']
 
-  plt.figure(figsize=(7.5,7.5))
-  plt.rcParams['legend.numpoints'] = 1
-  maxEntry = 0
-  minEntry = 0
-  maxDays = 0
-  for iCountry, country in enumerate(interestDataPlt):
-    xArray = array.array('d')
-    yArray = array.array('d')
-    nPoints = len(interestDataPlt[country][0])
-    passIncreasePoint = lowLimitCase
-    hasPassed = False
-    countPoints = 0
-    for iPoint in range(nPoints):
-      if iPoint != nPoints-1 : 
-        increase = interestDataPlt[country][1][iPoint+1]-interestDataPlt[country][1][iPoint]
-        if increase > passIncreasePoint:
-          hasPassed = True
-      # Has passed increase threshold
-      if hasPassed:
-        # Append data
-        xArray.append(countPoints)
-        yArray.append(interestDataPlt[country][1][iPoint])
-        # Find y max and x max
-        if country not in maxExcludeCountry:
-          # Limit number of days
-          if dayLimit == -1 or countPoints < dayLimit:
-            minEntry = min([minEntry, min(yArray)])
-            maxEntry = max([maxEntry, max(yArray)])
-            maxDays = max([maxDays, max(xArray)])
-        countPoints += 1
-    # If there is data passing increase threshold plot graph
-    if countPoints!= 0:
-      line, = plt.plot(xArray, yArray, color=colors[iCountry%len(colors)], linestyle='solid', marker=markers[iCountry%len(markers)], label=country, markersize=10)
-      plt.legend(loc="upper left", fontsize=10)
-   
-  # Graph settings
-  axes = plt.gca()
-  axes.set_xlim([0,maxDays+1])
-  axes.set_xlabel("Number of days from a daily increase of "+str(lowLimitCase)+" cases", fontsize=15)
-  axes.set_xticks(np.arange(0,maxDays+1, step=1))
-  axes.set_ylim([minEntry, maxEntry*1.2])
-  axes.set_ylabel('Cases', fontsize=15)
-  axes.set_title(title, fontsize=30, y=1.04)
-
-  print('Saving '+filename)
-  plt.savefig(filename)
-
-def getDataFromWorldInData(dataFolder='./', tag=''):
-  if not os.path.exists(dataFolder): os.makesdir(dataFolder)
-  confirmedUrl = 'http://cowid.netlify.com/data/full_data.csv'
-  filepath = os.path.join(dataFolder, tag+os.path.basename(confirmedUrl))
-
-  # Gets data from url
-  inFile = urllib2.urlopen(confirmedUrl)
-  # Saves data
-  tempData = inFile.read().decode('utf-8')
-  print('Saving '+confirmedUrl+' to '+filepath)
-  with open(filepath,'w') as outFile:
-    outFile.write(tempData)
-
-  # Collect rawData from file
-  # inFile[0] = ('date', 'location', 'new_cases', 'new_deaths', 'total_cases', 'total_deaths')
-  # inFile[1] = [(date, location, new_cases, new_deaths, total_cases, total_deaths)]
-  # rawData[country][date] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
-  rawData = {}
-  with open(filepath) as inFile:
-    for iRow, row in enumerate(csv.reader(inFile)):
-      # Ignore first line in file
-      if iRow == 0: continue
-      dateString, country, newCases, newDeaths, totalCases, totalDeaths = row
-      # Parse data
-      newCases = 0 if newCases=='' else int(newCases)
-      newDeaths = 0 if newDeaths=='' else int(newDeaths)
-      totalCases = 0 if totalCases=='' else int(totalCases)
-      totalDeaths = 0 if totalDeaths=='' else int(totalDeaths)
-      # Append data
-      if country not in rawData:
-        rawData[country] = {}
-      date= datetime.datetime.strptime(dateString,'%Y-%m-%d')
-      rawData[country][date] = ([newCases, newDeaths, None, totalCases, totalDeaths, None, None])
-
-  # Sort data
-  # data[country][date] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
-  data = collections.OrderedDict()
-  for country in sorted(rawData.keys()):
-    for date in sorted(rawData[country].keys()):
-      if country not in data:
-        data[country] = collections.OrderedDict()
-      data[country][date] = rawData[country][date]
-
-  return data
-
-def getDataFromJohnHopkins(dataFolder='./', tag=''):
-  if not os.path.exists(dataFolder): os.makesdir(dataFolder)
-  # Get time series data
-  links = [
-      "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Confirmed.csv",
-      "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Deaths.csv",
-      "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Recovered.csv",
-      ]
-  # Download files
-  files = []
-  for url in links:
-    filename = tag+os.path.basename(url)
-    filepath = os.path.join(dataFolder,filename)
-    files.append(filepath)
-    # Gets data from url
-    inFile = urllib2.urlopen(url)
-    # Saves data
-    tempData = inFile.read().decode('utf-8')
-    print('Saving '+url+' to '+filepath)
-    with open(filepath,'w') as outFile:
-      outFile.write(tempData)
-
-  # Collect rawData from files
-  # rawData[country][date] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
-  rawData = {}
-  for inFilePath in files:
-    combineCountries = {
-        'China': ['Mainland China'],
-        'South Korea':['Korea, South', 'Republic of Korea'],
-        'Taiwan':['Taiwan*'],
-        }
-    with open(inFilePath) as inFile:
-      inFile = open(inFilePath)
-      filename = os.path.basename(inFilePath)
-      # inFile = [Province/State,Country/Region,Latitude,Longitude, CasesForDate...]
-      for iRow, row in enumerate(csv.reader(inFile)):
-        # Parse first line in csv
-        if iRow == 0: 
-          dates = row[4:]
-          continue
-        region = row[0]
-        country = row[1]
-        cases = row[4:]
-        # Combine countries
-        for combineCountry in combineCountries:
-          if country in combineCountries[combineCountry]:
-            country = combineCountry
-        # Append data
-        for iDate, date in enumerate(dates):
-          date = datetime.datetime.strptime(date,'%m/%d/%y')
-          case = 0 if cases[iDate]=="" else int(cases[iDate])
-          if country not in rawData:
-            rawData[country] = {}
-          if date not in rawData[country]:
-            rawData[country][date] = [0,0,0,0,0,0,0]
-          # Collect region results to country
-          if "time_series_19-covid-Confirmed" in filename:
-            rawData[country][date][3] += case
-          if "time_series_19-covid-Deaths" in filename:
-            rawData[country][date][4] += case
-          if "time_series_19-covid-Recovered" in filename:
-            rawData[country][date][5] += case
-
-  # Sort data
-  # data[country][date] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
-  data = collections.OrderedDict()
-  for country in sorted(rawData.keys()):
-    for date in sorted(rawData[country].keys()):
-      if country not in data:
-        data[country] = collections.OrderedDict()
-      data[country][date] = rawData[country][date]
-
-  # Calculate new case and active cases
-  for country in data:
-    for iDate in range(len(data[country])):
-      date = list(data[country].keys())[iDate]
-      newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases = data[country][date]
-      data[country][date] = [newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalCases - totalRecoveries]
-      if iDate == 0: continue
-      previousDate = list(data[country].keys())[iDate-1]
-      previousNewCases, previousNewDeaths, previousNewRecoveries, previousTotalCases, previousTotalDeaths, previousTotalRecoveries, previousTotalActiveCases = data[country][previousDate]
-      data[country][date] = [totalCases - previousTotalCases, totalDeaths - previousTotalDeaths, totalRecoveries - previousTotalRecoveries, totalCases, totalDeaths, totalRecoveries, totalCases - totalRecoveries]
-
-  return data
+  def __init__(self, figsize=(7.5,7.5)):
+    import matplotlib.figure
+    # Not registered with pyplot, so it is freed as soon as the context is released
+    self.figure = matplotlib.figure.Figure(figsize=figsize)
+    self.axes = self.figure.add_subplot(111)
+    self.lines = []
+
+  # maxPoints > 0 draws at most that many points per country, picked by downsample.downsample with downsampleMethod
+  def draw(self, alignment, title="Total Cases", filename='totalCases.pdf', lowLimitCase=200, maxCase = -1, maxPoints=0, downsampleMethod='lttb'):
+    minEntry, maxEntry, maxDays = alignment.minEntry, alignment.maxEntry, alignment.maxDays
+    import matplotlib
+    matplotlib.rcParams['legend.numpoints'] = 1
+    axes = self.axes
+    # Reuse lines of the previous plot, adding or removing lines as needed
+    nLines = 0
+    for iCountry, (country, cases) in enumerate(alignment.series.items()):
+      # If there is data passing increase threshold plot graph
+      if len(cases) == 0: continue
+      if nLines == len(self.lines): self.lines.append(axes.plot([], [], linestyle='solid', markersize=10)[0])
+      line = self.lines[nLines]
+      line.set_data(*downsample(cases, maxPoints, downsampleMethod))
+      line.set_color(self.colors[iCountry%len(self.colors)])
+      line.set_marker(self.markers[iCountry%len(self.markers)])
+      line.set_label(country)
+      nLines += 1
+    for line in self.lines[nLines:]: line.remove()
+    del self.lines[nLines:]
+    # Legend is built once, from the final set of lines
+    if axes.get_legend() is not None: axes.get_legend().remove()
+    if nLines != 0: axes.legend(handles=self.lines, loc="upper left", fontsize=10)
+
+    # Graph settings
+    axes.set_xlim([0,maxDays+1])
+    axes.set_xlabel("Number of days from a daily increase of "+str(lowLimitCase)+" cases", fontsize=15)
+    # Ticks every day for short ranges, every few days for long ones
+    axes.set_xticks(np.arange(0,maxDays+1, step=tickStep(maxDays)))
+    axes.set_ylim([minEntry, maxEntry*1.2])
+    axes.set_ylabel('Cases', fontsize=15)
+    axes.set_title(title, fontsize=30, y=1.04)
+
+    print('Saving '+filename)
+    with profiling.stage('savefig') as timer:
+      self.figure.savefig(filename)
+      timer.add(plots=1)
+
+  def close(self):
+    self.figure.clear()
+    self.lines = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+# Figure shared by drawAlignment calls in this process
+plotContext = None
+
+# Draws countries aligned by alignCases, reusing the shared figure unless context is given
+def drawAlignment(alignment, title="Total Cases", filename='totalCases.pdf', lowLimitCase=200, maxCase = -1, maxPoints=0, downsampleMethod='lttb', context=None):
+  global plotContext
+  if context is None:
+    if plotContext is None: plotContext = PlotContext()
+    context = plotContext
+  context.draw(alignment, title=title, filename=filename, lowLimitCase=lowLimitCase, maxCase=maxCase, maxPoints=maxPoints, downsampleMethod=downsampleMethod)
+
+# Releases the shared figure, called by renderPool at the end of a batch of plots
+def closePlotContext():
+  global plotContext
+  if plotContext is not None: plotContext.close()
+  plotContext = None
+
+# Called by renderPool workers
+def setBatch():
+  import matplotlib
+  matplotlib.use('Agg')
 
 if __name__ == "__main__":
 
   parser = argparse.ArgumentParser(description='Makes coronavirus graphs depending on countries. By default uses ourworldindata.')
   parser.add_argument('--jh', default=False, action='store_true', help='Use John Hopkins data')
   parser.add_argument('--wd', default=False, action='store_true', help='Use ourworldindata data')
+  parser.add_argument('--merged', default=False, action='store_true', help='Use ourworldindata data joined with John Hopkins data for recoveries')
   parser.add_argument('--outputFolder', default='./', help='Folder to store data and results')
   parser.add_argument('--png', default=False, action='store_true', help='Make plots with png')
   parser.add_argument('--dateTag', default=False, action='store_true', help='Add date tag to output files')
+  parser.add_argument('--archive', default=False, action='store_true', help='With --dateTag, keep each day of downloaded files in outputFolder/snapshots, with the latest downloads and caches kept without the date tag')
+  parser.add_argument('--restoreDate', default='', help='Make plots from the files archived on this date (YYYYMMDD), without fetching')
+  parser.add_argument('--incremental', default=False, action='store_true', help='Only merge new dates and revised cells into the cached data')
+  parser.add_argument('--jobs', default=1, type=int, help='Number of processes used to render plots')
+  parser.add_argument('--regionsOf', default=[], nargs='*', help='Plot the Province/State regions of these countries instead of countries (John Hopkins data)')
+  parser.add_argument('--rolling', default=0, type=int, help='Also plot moving averages over this many days, adding the rollingStatistics metrics (0 for none)')
+  parser.add_argument('--population', default='', help='csv of country,population for the per million metrics of --rolling')
+  parser.add_argument('--maxPoints', default=0, type=int, help='Draw at most this many points per country, keeping peaks (0 for all points)')
+  parser.add_argument('--downsample', default='lttb', choices=['lttb', 'minmax'], help='How --maxPoints picks points: largest-triangle-three-buckets or the minimum and maximum of each bucket')
+  parser.add_argument('--report', default=False, action='store_true', help='Also make a page per country with all its metrics, in one pdf (or a png per country with --png, drawn on --jobs processes)')
+  parser.add_argument('--fetch-only', default=False, action='store_true', help='Only download the source files')
+  parser.add_argument('--parse-only', default=False, action='store_true', help='Only parse the downloaded files into the cache')
+  parser.add_argument('--render-only', default=False, action='store_true', help='Only make plots from the downloaded files, without fetching')
+  parser.add_argument('--timingLog', default='', help='Append the run time of this run as a json line to this file')
+  parser.add_argument('--profile', default=False, action='store_true', help='Time each stage and write a json report to outputFolder/profile.json')
+  parser.add_argument('--profileDump', default=False, action='store_true', help='With --profile, also dump cProfile stats of the slowest stage to outputFolder/profile.prof')
   args = parser.parse_args()
+  importTime = time.time()-startTime
+  if args.profile: profiling.enable(cProfileStages=args.profileDump)
 
   # Handle arguments
   # Set dataType
   if args.wd: dataType = "WorldInData"
   elif args.jh: dataType = "JohnHopkins"
+  elif args.merged: dataType = "Merged"
   else: dataType = "WorldInData"
   # Set plotExtension
   if args.png: plotExtension = 'png'
@@ -245,36 +146,92 @@ if __name__ == "__main__":
   # Set tag
   if args.dateTag: outputTag = datetime.datetime.now().strftime('%Y%m%d')+"_"
   else: outputTag = '' 
+  if args.restoreDate != '': outputTag = args.restoreDate+"_"
+  archiveFolder = os.path.join(args.outputFolder, 'snapshots')
+  # With --archive the downloads, their validators and caches keep undated names, so conditional requests
+  # and cached data carry over from one day to the next, and each day is kept in the archive instead
+  archive = args.archive and args.dateTag and args.restoreDate == ''
+  dataTag = '' if archive else outputTag
+  # Set stages to run
+  if args.fetch_only: mode = 'fetch-only'
+  elif args.parse_only: mode = 'parse-only'
+  elif args.render_only: mode = 'render-only'
+  else: mode = 'full'
+  fetch = mode in ['full', 'fetch-only'] and args.restoreDate == ''
+  parse = mode != 'fetch-only'
+  # Files of an archived day are written back under their dated names
+  if args.restoreDate != '': restoreSnapshot(archiveFolder, outputTag, args.outputFolder)
 
   # Gets data from source
   # data[country][date] = (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
   if dataType == "WorldInData": 
-    data = getDataFromWorldInData(dataFolder=args.outputFolder, tag=outputTag)
+    data = getDataFromWorldInData(dataFolder=args.outputFolder, tag=dataTag, incremental=args.incremental, fetch=fetch, parse=parse)
   if dataType == "JohnHopkins":
-    data = getDataFromJohnHopkins(dataFolder=args.outputFolder, tag=outputTag)
+    data = getDataFromJohnHopkins(dataFolder=args.outputFolder, tag=dataTag, incremental=args.incremental, fetch=fetch, parse=parse)
+  if dataType == "Merged":
+    data = getMergedData(dataFolder=args.outputFolder, tag=dataTag, incremental=args.incremental, fetch=fetch, parse=parse)
 
-  # Printing country names
-  print('Countries: '+', '.join(data.keys()))
+  # The downloads of the day are stored once in the archive, as deltas against the previous day
+  if archive and fetch: addSnapshot(archiveFolder, outputTag, sourceFiles(dataType, args.outputFolder, dataTag))
 
-  # Plots countries that have a daily increase of above lowLimitCase
-  #
-  # Can set countries one is interested in. Below is an example.
-  # interestedCountries = ["China", "Italy", "Iran", "South Korea", "Germany", "United States", "Switzerland"]
-  #
-  # data[country][date] = (0: newCases, 1: newDeaths, 2: newRecoveries, 3: totalCases, 4: totalDeaths, 5: totalRecoveries, 6: totalActiveCases)
-  # interestedIndex: the index in data to use for plotting
-  interestedCountries = []
-  if dataType == "WorldInData":
-    drawCases(data, interestedIndex=3, title="Total Cases", filename=os.path.join(args.outputFolder,outputTag+'TotalCasesWD.'+plotExtension), 
-      lowLimitCase=150, interestedCountries=interestedCountries)
-    drawCases(data, interestedIndex=4, title="Total Deaths", filename=os.path.join(args.outputFolder,outputTag+'TotalDeathsWD.'+plotExtension), 
-      lowLimitCase=7, interestedCountries=interestedCountries)
-  if dataType == "JohnHopkins":
-    drawCases(data, interestedIndex=3, title="Total Cases", filename=os.path.join(args.outputFolder,outputTag+'TotalCasesJH.'+plotExtension), 
-      lowLimitCase=150, interestedCountries=interestedCountries)
-    drawCases(data, interestedIndex=4, title="Total Deaths", filename=os.path.join(args.outputFolder,outputTag+'TotalDeathsJH.'+plotExtension), 
-      lowLimitCase=7, interestedCountries=interestedCountries)
-    drawCases(data, interestedIndex=5, title="Total Recoveries", filename=os.path.join(args.outputFolder,outputTag+'TotalRecoveriesJH.'+plotExtension), 
-      lowLimitCase=10, interestedCountries=interestedCountries)
-    drawCases(data, interestedIndex=6, title="Total Active Cases", filename=os.path.join(args.outputFolder,outputTag+'TotalActiveCasesJH.'+plotExtension), 
-      lowLimitCase=150, interestedCountries=interestedCountries)
+  # Printing country names
+  if data is not None: print('Countries: '+', '.join(data.keys()))
+
+  if mode in ['full', 'render-only']:
+    # Plots countries that have a daily increase of above lowLimitCase
+    #
+    # Can set countries one is interested in. Below is an example.
+    # interestedCountries = ["China", "Italy", "Iran", "South Korea", "Germany", "United States", "Switzerland"]
+    #
+    # data[country][date] = (0: newCases, 1: newDeaths, 2: newRecoveries, 3: totalCases, 4: totalDeaths, 5: totalRecoveries, 6: totalActiveCases)
+    # interestedIndex: the index in data to use for plotting
+    interestedCountries = []
+    # Regions are plotted like countries, from the region rows of John Hopkins data
+    levelTag = ''
+    if dataType == "JohnHopkins" and len(args.regionsOf) != 0:
+      data = data.regions
+      interestedCountries = [region for country in args.regionsOf for region in data.hierarchy.regionsOf(country)]
+      levelTag = 'Regions'
+    sourceTag = {'WorldInData': 'WD', 'JohnHopkins': 'JH'+levelTag, 'Merged': 'MG'}[dataType]
+    # Moving averages, growth and per million metrics follow the 7 metrics, as listed in rollingStatistics.allMetricNames
+    if args.rolling > 0:
+      data = addRollingStatistics(data, args.rolling, loadPopulation(args.population) if args.population != '' else {})
+    plots = []
+    if dataType == "WorldInData":
+      plots.append(dict(interestedIndex=3, title="Total Cases", filename=os.path.join(args.outputFolder,outputTag+'TotalCasesWD.'+plotExtension), 
+        lowLimitCase=150, interestedCountries=interestedCountries))
+      plots.append(dict(interestedIndex=4, title="Total Deaths", filename=os.path.join(args.outputFolder,outputTag+'TotalDeathsWD.'+plotExtension), 
+        lowLimitCase=7, interestedCountries=interestedCountries))
+    if dataType in ["JohnHopkins", "Merged"]:
+      plots.append(dict(interestedIndex=3, title="Total Cases", filename=os.path.join(args.outputFolder,outputTag+'TotalCases'+sourceTag+'.'+plotExtension), 
+        lowLimitCase=150, interestedCountries=interestedCountries))
+      plots.append(dict(interestedIndex=4, title="Total Deaths", filename=os.path.join(args.outputFolder,outputTag+'TotalDeaths'+sourceTag+'.'+plotExtension), 
+        lowLimitCase=7, interestedCountries=interestedCountries))
+      plots.append(dict(interestedIndex=5, title="Total Recoveries", filename=os.path.join(args.outputFolder,outputTag+'TotalRecoveries'+sourceTag+'.'+plotExtension), 
+        lowLimitCase=10, interestedCountries=interestedCountries))
+      plots.append(dict(interestedIndex=6, title="Total Active Cases", filename=os.path.join(args.outputFolder,outputTag+'TotalActiveCases'+sourceTag+'.'+plotExtension), 
+        lowLimitCase=150, interestedCountries=interestedCountries))
+    if args.rolling > 0:
+      plots.append(dict(interestedIndex=allMetricNames.index('newCasesAverage'), title="New Cases (%d-day average)" % args.rolling, filename=os.path.join(args.outputFolder,outputTag+'NewCasesAverage'+sourceTag+'.'+plotExtension), 
+        lowLimitCase=10, interestedCountries=interestedCountries))
+      plots.append(dict(interestedIndex=allMetricNames.index('newDeathsAverage'), title="New Deaths (%d-day average)" % args.rolling, filename=os.path.join(args.outputFolder,outputTag+'NewDeathsAverage'+sourceTag+'.'+plotExtension), 
+        lowLimitCase=1, interestedCountries=interestedCountries))
+    # Long series are downsampled between aligning and drawing
+    if args.maxPoints > 0:
+      for plot in plots: plot.update(maxPoints=args.maxPoints, downsampleMethod=args.downsample)
+    # Each plot is a set of drawCases arguments, drawn on args.jobs processes
+    renderPlots(data, plots, jobs=args.jobs)
+    # Every country is aligned once and its page drawn on a reused figure, on args.jobs processes
+    if args.report:
+      reportName = os.path.join(args.outputFolder, outputTag+'Report'+sourceTag)
+      makeReport(data, reportName+'.pdf' if plotExtension == 'pdf' else reportName, interestedCountries=interestedCountries, jobs=args.jobs)
+
+  # Run time of this mode, including imports
+  runTime = time.time()-startTime
+  print('Finished %s run in %.3f s (imports %.3f s)' % (mode, runTime, importTime))
+  if args.timingLog != '':
+    with open(args.timingLog, 'a') as logFile:
+      logFile.write(json.dumps({'script': os.path.basename(__file__), 'mode': mode, 'dataType': dataType, 'date': datetime.datetime.now().isoformat(), 'seconds': runTime, 'importSeconds': importTime})+'\n')
+  if args.profile:
+    profiling.writeReport(os.path.join(args.outputFolder, outputTag+'profile.json'), {'script': os.path.basename(__file__), 'mode': mode, 'dataType': dataType, 'seconds': runTime, 'importSeconds': importTime},
+        profilePath=os.path.join(args.outputFolder, outputTag+'profile.prof') if args.profileDump else '')
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+  from urlparse import urlparse, parse_qs
+except:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+  from urllib.parse import urlparse, parse_qs
+import time
+import argparse
+import collections
+import hashlib
+import importlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from getData import getDataFromWorldInData, getDataFromJohnHopkins
+from renderPool import prepareJob
+from downsample import downsamplers
+from timeSeries import metricNames
+
+contentTypes = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+titles = ['New Cases', 'New Deaths', 'New Recoveries', 'Total Cases', 'Total Deaths', 'Total Recoveries', 'Total Active Cases']
+
+# Rendered plots, least recently used first, bounded by the total size of the images
+# cache[key] = bytes
+class RenderCache(object):
+  def __init__(self, maxBytes=64<<20):
+    self.maxBytes = maxBytes
+    self.nBytes = 0
+    self.entries = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      if key not in self.entries:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return self.entries[key]
+
+  def put(self, key, image):
+    with self.lock:
+      if key in self.entries: self.nBytes -= len(self.entries.pop(key))
+      self.entries[key] = image
+      self.nBytes += len(image)
+      while self.nBytes > self.maxBytes and len(self.entries) > 1:
+        self.nBytes -= len(self.entries.popitem(last=False)[1])
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.nBytes = 0
+
+  def status(self):
+    with self.lock:
+      return {'entries': len(self.entries), 'megabytes': self.nBytes/1e6, 'hits': self.hits, 'misses': self.misses}
+
+# Version of a dataset, changing whenever one of its source files changes
+def dataVersion(data):
+  return hashlib.sha256(json.dumps(sorted(data.sourceHashes.items())).encode()).hexdigest()[:16]
+
+# Keeps a dataset in memory and renders plots of it, memoized on the request and the data version
+# load(fetch) returns the dataset, fetching new source files when fetch is True
+class PlotServer(object):
+  def __init__(self, load, renderer='makeGraphs', cacheBytes=64<<20, offline=False):
+    self.load = load
+    self.offline = offline
+    self.renderer = importlib.import_module(renderer)
+    self.renderer.setBatch()
+    self.cache = RenderCache(cacheBytes)
+    # Drawing shares one figure, so plots are rendered one at a time
+    self.renderLock = threading.Lock()
+    self.dataLock = threading.Lock()
+    self.folder = tempfile.mkdtemp(prefix='plotServer')
+    self.data = load(False)
+    self.version = dataVersion(self.data)
+
+  # Reloads the dataset, dropping rendered plots when its source files changed
+  def refresh(self):
+    data = self.load(not self.offline)
+    version = dataVersion(data)
+    with self.dataLock:
+      if version == self.version: return False
+      self.data, self.version = data, version
+    self.cache.clear()
+    print('Data changed to version '+version+', cleared render cache')
+    return True
+
+  # Normalized plot arguments from query parameters
+  # metric (index or name), threshold, countries (comma separated), dayLimit, maxCountries, sortIndex, maxPoints, downsample, format
+  def plotArguments(self, parameters):
+    def get(name, default):
+      return parameters[name][0] if name in parameters else default
+    metric = get('metric', '3')
+    interestedIndex = metricNames.index(metric) if metric in metricNames else int(metric)
+    countries = get('countries', '')
+    plotFormat = get('format', 'png')
+    downsampleMethod = get('downsample', 'lttb')
+    if downsampleMethod not in downsamplers: raise ValueError('downsample must be one of '+', '.join(sorted(downsamplers)))
+    if plotFormat not in contentTypes: raise ValueError('format must be one of '+', '.join(sorted(contentTypes)))
+    if interestedIndex < 0 or interestedIndex >= len(metricNames): raise ValueError('metric must be 0 to %d or a metric name' % (len(metricNames)-1))
+    sortIndex = int(get('sortIndex', '4'))
+    if sortIndex < 0 or sortIndex >= len(metricNames): raise ValueError('sortIndex must be 0 to %d' % (len(metricNames)-1))
+    lowLimitCase = float(get('threshold', '150'))
+    if not math.isfinite(lowLimitCase): raise ValueError('threshold must be a finite number')
+    maxCountries = int(get('maxCountries', '-1'))
+    if maxCountries < -1: raise ValueError('maxCountries must be -1 (all countries) or more')
+    return collections.OrderedDict([
+        ('interestedIndex', interestedIndex),
+        ('title', get('title', titles[interestedIndex])),
+        ('lowLimitCase', lowLimitCase),
+        ('interestedCountries', tuple(sorted(country for country in countries.split(',') if country != ''))),
+        ('dayLimit', int(get('dayLimit', '-1'))),
+        ('maxCountries', maxCountries),
+        ('sortIndex', sortIndex),
+        ('maxPoints', int(get('maxPoints', '0'))),
+        ('downsampleMethod', downsampleMethod),
+        ('format', plotFormat),
+        ])
+
+  # Returns (image, cached), with image None when the renderer drew nothing
+  def plot(self, arguments):
+    with self.dataLock:
+      data, version = self.data, self.version
+    key = (version,) + tuple(arguments.items())
+    image = self.cache.get(key)
+    if image is not None: return image, True
+    plot = dict(arguments)
+    plotFormat = plot.pop('format')
+    plot['interestedCountries'] = list(plot['interestedCountries'])
+    if plot['lowLimitCase'] == int(plot['lowLimitCase']): plot['lowLimitCase'] = int(plot['lowLimitCase'])
+    with self.renderLock:
+      plot['filename'] = os.path.join(self.folder, 'plot.'+plotFormat)
+      # Remove the previous plot so it is never returned for this one
+      if os.path.exists(plot['filename']): os.remove(plot['filename'])
+      self.renderer.drawAlignment(**prepareJob(data, **plot))
+      if not os.path.exists(plot['filename']): return None, False
+      with open(plot['filename'], 'rb') as inFile:
+        image = inFile.read()
+    self.cache.put(key, image)
+    return image, False
+
+  def close(self):
+    self.renderer.closePlotContext()
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+# GET /plot?metric=totalCases&threshold=150&countries=Italy,Spain&format=png
+# GET /countries, GET /status, POST /refresh
+class PlotRequestHandler(BaseHTTPRequestHandler):
+  plotServer = None
+
+  def reply(self, status, body, contentType='application/json', headers={}):
+    self.send_response(status)
+    self.send_header('Content-Type', contentType)
+    self.send_header('Content-Length', str(len(body)))
+    for name in headers: self.send_header(name, headers[name])
+    self.end_headers()
+    self.wfile.write(body)
+
+  def replyJson(self, status, value):
+    self.reply(status, json.dumps(value).encode())
+
+  def do_GET(self):
+    server = self.plotServer
+    url = urlparse(self.path)
+    if url.path == '/plot':
+      try:
+        arguments = server.plotArguments(parse_qs(url.query))
+      except ValueError as error:
+        return self.replyJson(400, {'error': str(error)})
+      startTime = time.time()
+      image, cached = server.plot(arguments)
+      if image is None: return self.replyJson(404, {'error': 'Nothing to plot, no selected country has data'})
+      self.reply(200, image, contentTypes[arguments['format']], {'X-Data-Version': server.version, 'X-Cache': 'hit' if cached else 'miss', 'X-Render-Seconds': '%.4f' % (time.time()-startTime)})
+    elif url.path == '/countries':
+      self.replyJson(200, server.data.countries)
+    elif url.path == '/status':
+      self.replyJson(200, {'dataVersion': server.version, 'dates': [str(server.data.dateAxis[0]), str(server.data.dateAxis[-1])] if len(server.data.dates) != 0 else [], 'cache': server.cache.status()})
+    else:
+      self.replyJson(404, {'error': 'unknown path '+url.path})
+
+  def do_POST(self):
+    if urlparse(self.path).path != '/refresh': return self.replyJson(404, {'error': 'unknown path '+self.path})
+    try:
+      changed = self.plotServer.refresh()
+    except Exception as error:
+      return self.replyJson(500, {'error': 'Refresh failed: '+str(error)})
+    self.replyJson(200, {'changed': changed, 'dataVersion': self.plotServer.version})
+
+# Refreshes the data every interval seconds
+def refreshLoop(plotServer, interval):
+  while True:
+    time.sleep(interval)
+    try:
+      plotServer.refresh()
+    except Exception as error:
+      print('Refresh failed: '+str(error))
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser(description='Serves coronavirus graphs over http, keeping the data in memory. By default uses ourworldindata.')
+  parser.add_argument('--jh', default=False, action='store_true', help='Use John Hopkins data')
+  parser.add_argument('--wd', default=False, action='store_true', help='Use ourworldindata data')
+  parser.add_argument('--outputFolder', default='./', help='Folder to store data')
+  parser.add_argument('--renderer', default='makeGraphs', help='Plotting module, makeGraphs or makeGraphsWithROOT')
+  parser.add_argument('--host', default='localhost', help='Address to listen on')
+  parser.add_argument('--port', default=8020, type=int, help='Port to listen on')
+  parser.add_argument('--cacheMB', default=64, type=float, help='Size of the render cache in MB')
+  parser.add_argument('--refresh', default=3600, type=float, help='Seconds between checks for new data (0 for never)')
+  parser.add_argument('--offline', default=False, action='store_true', help='Never fetch, only use the files already in outputFolder')
+  args = parser.parse_args()
+
+  if args.jh: getData = lambda fetch: getDataFromJohnHopkins(dataFolder=args.outputFolder, fetch=fetch)
+  else: getData = lambda fetch: getDataFromWorldInData(dataFolder=args.outputFolder, fetch=fetch)
+  # Start from the files on disk when there are any, so the server comes up without the network
+  def load(fetch):
+    try:
+      return getData(fetch)
+    except (IOError, OSError):
+      if fetch or args.offline: raise
+      return getData(True)
+
+  plotServer = PlotServer(load, renderer=args.renderer, cacheBytes=int(args.cacheMB*1e6), offline=args.offline)
+  if not args.offline: plotServer.refresh()
+  if args.refresh > 0:
+    thread = threading.Thread(target=refreshLoop, args=(plotServer, args.refresh))
+    thread.daemon = True
+    thread.start()
+  PlotRequestHandler.plotServer = plotServer
+  httpServer = ThreadingHTTPServer((args.host, args.port), PlotRequestHandler)
+  print('Serving plots on http://%s:%d/plot (data version %s)' % (args.host, args.port, plotServer.version))
+  try:
+    httpServer.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    httpServer.server_close()
+    plotServer.close()
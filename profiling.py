@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+import collections
+import json
+import threading
+import time
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# Timers and counters around the stages of a run, off unless enable() is called
+# stages[name] = {'calls', 'seconds', 'peakRssMB', counter: total}
+# With cProfile enabled, each top-level stage of the main thread is also profiled and the slowest one can be dumped
+enabled = False
+stages = collections.OrderedDict()
+profiles = {}
+useCProfile = False
+lock = threading.Lock()
+activeStages = threading.local()
+
+def enable(cProfileStages=False):
+  global enabled, useCProfile
+  enabled = True
+  useCProfile = cProfileStages
+
+# Peak resident memory of this process so far, in MB
+def peakRssMB():
+  if resource is None: return 0.
+  # ru_maxrss is in kB on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+class Stage(object):
+  def __init__(self, name):
+    self.name = name
+    self.counters = collections.Counter()
+    self.profile = None
+
+  def add(self, **counters):
+    self.counters.update(counters)
+
+  def __enter__(self):
+    depth = getattr(activeStages, 'depth', 0)
+    activeStages.depth = depth+1
+    # cProfile can only run one profiler at a time, so nested stages are part of their parent's profile
+    if useCProfile and depth == 0 and threading.current_thread() is threading.main_thread():
+      import cProfile
+      self.profile = cProfile.Profile()
+      self.profile.enable()
+    self.startTime = time.time()
+    return self
+
+  def __exit__(self, *exception):
+    seconds = time.time()-self.startTime
+    if self.profile is not None: self.profile.disable()
+    activeStages.depth -= 1
+    with lock:
+      entry = stages.setdefault(self.name, collections.OrderedDict([('calls', 0), ('seconds', 0.)]))
+      entry['calls'] += 1
+      entry['seconds'] += seconds
+      entry['peakRssMB'] = peakRssMB()
+      for counter in self.counters: entry[counter] = entry.get(counter, 0) + self.counters[counter]
+      if self.profile is not None:
+        if self.name in profiles: profiles[self.name].append(self.profile)
+        else: profiles[self.name] = [self.profile]
+
+# Does nothing, so instrumented code costs one attribute lookup when profiling is off
+class NoStage(object):
+  def add(self, **counters):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    pass
+
+noStage = NoStage()
+
+# with stage('parse') as timer: ...; timer.add(rows=nRows)
+def stage(name):
+  return Stage(name) if enabled else noStage
+
+# Returns the stages recorded so far and starts over, for sending results of worker processes back
+def takeStages():
+  global stages
+  with lock:
+    taken, stages = stages, collections.OrderedDict()
+  return taken
+
+# Adds stages recorded elsewhere, by takeStages in a worker process
+def mergeStages(otherStages):
+  with lock:
+    for name in otherStages:
+      entry = stages.setdefault(name, collections.OrderedDict([('calls', 0), ('seconds', 0.)]))
+      for key, value in otherStages[name].items():
+        if key == 'peakRssMB': entry[key] = max(entry.get(key, 0.), value)
+        else: entry[key] = entry.get(key, 0) + value
+
+# Writes the json report to reportPath, with extra fields from info
+# When cProfile was enabled, the cProfile stats of the slowest profiled stage are dumped to profilePath
+def writeReport(reportPath, info={}, profilePath=''):
+  report = collections.OrderedDict(info)
+  report['peakRssMB'] = peakRssMB()
+  report['stages'] = stages
+  if len(stages) != 0: report['slowestStage'] = max(stages, key=lambda name: stages[name]['seconds'])
+  if profilePath != '' and len(profiles) != 0:
+    import pstats
+    slowest = max(profiles, key=lambda name: stages[name]['seconds'])
+    stats = pstats.Stats(*profiles[slowest])
+    stats.dump_stats(profilePath)
+    report['cProfileStage'] = slowest
+    report['cProfileDump'] = profilePath
+    print('Saving cProfile of stage '+slowest+' to '+profilePath)
+  with open(reportPath, 'w') as outFile:
+    json.dump(report, outFile, indent=2)
+  print('Saving '+reportPath)
+  for name in stages:
+    print('%-20s %6d calls %9.3f s' % (name, stages[name]['calls'], stages[name]['seconds']))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import numpy as np
+from timeSeries import toDatetime64
+
+# Queries over a TimeSeries: latest values per metric, country filters and top-k selection
+# lastValid(iMetric)[iCountry, iDate] = index of the last date up to iDate where the metric is valid, -1 if none
+# It is made once per metric, after which the latest value of every country in any date range is one lookup.
+class Query(object):
+  def __init__(self, data):
+    self.data = data
+    self.lastValidIndices = {}
+
+  def lastValid(self, iMetric):
+    if iMetric not in self.lastValidIndices:
+      nDates = len(self.data.dates)
+      dateIndices = np.where(np.asarray(self.data.valid[:, :, iMetric]), np.arange(nDates), -1)
+      self.lastValidIndices[iMetric] = np.maximum.accumulate(dateIndices, axis=1) if nDates != 0 else dateIndices
+    return self.lastValidIndices[iMetric]
+
+  # Returns (start, end) date indices for dates in [startDate, endDate), or the last days dates before endDate
+  def dateRange(self, startDate=None, endDate=None, days=None):
+    dateAxis = self.data.dateAxis
+    end = len(dateAxis) if endDate is None else int(np.searchsorted(dateAxis, toDatetime64(endDate)))
+    if days is not None: return max(end-days, 0), end
+    start = 0 if startDate is None else int(np.searchsorted(dateAxis, toDatetime64(startDate)))
+    return start, end
+
+  # Returns (latest, hasValue) with latest[iCountry] = last valid value of the metric within the date range
+  # and hasValue[iCountry] = False when the country has no valid value in the range
+  def latest(self, iMetric, startDate=None, endDate=None, days=None):
+    start, end = self.dateRange(startDate, endDate, days)
+    nCountries = len(self.data.countries)
+    if end <= start: return np.zeros(nCountries, dtype=np.int64), np.zeros(nCountries, dtype=bool)
+    dateIndices = self.lastValid(iMetric)[:, end-1]
+    hasValue = dateIndices >= start
+    latest = np.asarray(self.data.values[np.arange(nCountries), np.maximum(dateIndices, 0), iMetric])
+    return np.where(hasValue, latest, 0), hasValue
+
+  # mask[iCountry] = True for countries in include (all when include is empty) and not in exclude
+  def mask(self, include=(), exclude=()):
+    countries = self.data.countries
+    mask = np.ones(len(countries), dtype=bool)
+    if len(include) != 0:
+      include = set(include)
+      mask &= np.fromiter((country in include for country in countries), dtype=bool, count=len(countries))
+    if len(exclude) != 0:
+      exclude = set(exclude)
+      mask &= np.fromiter((country not in exclude for country in countries), dtype=bool, count=len(countries))
+    return mask
+
+  # Countries sorted by their latest value of the metric in the date range, largest first, ties in country order
+  # Countries without a value in the range come last. Only the top k are sorted; k=-1 sorts all of them.
+  def topK(self, iMetric, k=-1, include=(), exclude=(), startDate=None, endDate=None, days=None):
+    latest, hasValue = self.latest(iMetric, startDate, endDate, days)
+    indices = np.flatnonzero(self.mask(include, exclude))
+    # Rank so that countries without a value sort below every value
+    keys = np.where(hasValue[indices], latest[indices].astype(np.float64), -np.inf)
+    if k != -1 and k < len(indices):
+      # Partition on the k-th largest value, then keep every country tied with it so ties still go by country order
+      kthValue = -np.partition(-keys, k-1)[k-1]
+      indices, keys = indices[keys >= kthValue], keys[keys >= kthValue]
+    order = np.lexsort((indices, -keys))
+    if k != -1: order = order[:k]
+    return [self.data.countries[iCountry] for iCountry in indices[order]]
+
+  # TimeSeries of the dates in [startDate, endDate), sharing memory with the data
+  def sliceDates(self, startDate=None, endDate=None):
+    return self.data.sliceDates(startDate, endDate)
+
+# Query of data, made once and kept on data
+def queryOf(data):
+  if data.query is None: data.query = Query(data)
+  return data.query
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import concurrent.futures
+import importlib
+import multiprocessing.util
+import time
+import profiling
+from alignCases import alignCases, defaultIgnoreCountries, defaultMaxExcludeCountry
+
+# Aligns the data of one plot in the parent process
+# Takes the drawCases arguments and returns the arguments of drawAlignment, so a worker only receives the aligned arrays
+# Other keyword arguments are passed on to drawAlignment
+def prepareJob(data, align=alignCases, interestedIndex=3, title="Total Cases", filename='totalCases.pdf', dayLimit=-1, lowLimitCase=200, maxCase=-1, interestedCountries=[], ignoreCountries=defaultIgnoreCountries, maxExcludeCountry=defaultMaxExcludeCountry, sortIndex=4, maxCountries=-1, **drawArguments):
+  alignment = align(data, interestedIndex, lowLimitCase, dayLimit=dayLimit, interestedCountries=interestedCountries, ignoreCountries=ignoreCountries, maxExcludeCountry=maxExcludeCountry, sortIndex=sortIndex, maxCountries=maxCountries)
+  return dict(drawArguments, alignment=alignment, title=title, filename=filename, lowLimitCase=lowLimitCase, maxCase=maxCase)
+
+# Workers render without a display, record stages when the parent does and release their figure when the pool shuts down
+def initWorker(renderer, profile=False):
+  if profile: profiling.enable()
+  # Forked workers start with a copy of the parent's stages, which the parent already counts
+  profiling.takeStages()
+  module = importlib.import_module(renderer)
+  module.setBatch()
+  # Run by multiprocessing as the worker exits, where atexit handlers are not run
+  multiprocessing.util.Finalize(None, module.closePlotContext, exitpriority=10)
+
+# Draws one plot with renderer.drawAlignment, renderer being the module name of the plotting script
+# Returns (filename, seconds, stages) with the stages recorded by profiling in a worker process (collectStages)
+def renderJob(renderer, job, collectStages=False):
+  startTime = time.time()
+  with profiling.stage('render') as timer:
+    importlib.import_module(renderer).drawAlignment(**job)
+    timer.add(plots=1)
+  return job['filename'], time.time()-startTime, profiling.takeStages() if collectStages else {}
+
+# Makes plots, each given as drawCases keyword arguments, on jobs processes
+# align(data, ...) aligns the countries of a plot, with the arguments of alignCases
+# The figure of the renderer is released once the plots are made
+# Returns timings[filename] = seconds
+def renderPlots(data, plots, jobs=1, renderer='makeGraphs', align=alignCases):
+  startTime = time.time()
+  renderJobs = [prepareJob(data, align, **plot) for plot in plots]
+  alignTime = time.time()-startTime
+  if jobs == 1:
+    results = [renderJob(renderer, job) for job in renderJobs]
+    importlib.import_module(renderer).closePlotContext()
+  else:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initWorker, initargs=(renderer, profiling.enabled)) as executor:
+      results = list(executor.map(renderJob, [renderer]*len(renderJobs), renderJobs, [True]*len(renderJobs)))
+  timings = dict((filename, seconds) for filename, seconds, stages in results)
+  for filename, seconds, stages in results:
+    profiling.mergeStages(stages)
+    print('Rendered %s in %.3f s' % (filename, seconds))
+  print('Rendered %d plots on %d processes in %.3f s (aligning %.3f s)' % (len(plots), jobs, time.time()-startTime, alignTime))
+  return timings
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import csv
+import numpy as np
+from timeSeries import TimeSeries, metricNames
+
+# Metrics added after the metrics of timeSeries.metricNames, so they are plotted with interestedIndex = 7, 8, ...
+# (7: newCasesAverage, 8: newDeathsAverage, 9: growthRate, 10: doublingTime,
+#  11: totalCasesPerMillion, 12: totalDeathsPerMillion, 13: newCasesAveragePerMillion)
+# Averages and growth are over the window days up to and including each date
+rollingMetricNames = ['newCasesAverage', 'newDeathsAverage', 'growthRate', 'doublingTime', 'totalCasesPerMillion', 'totalDeathsPerMillion', 'newCasesAveragePerMillion']
+allMetricNames = metricNames + rollingMetricNames
+
+# Reads population[country] = number of people from a csv with columns country,population
+def loadPopulation(path):
+  population = {}
+  with open(path) as inFile:
+    for iRow, row in enumerate(csv.reader(inFile)):
+      if iRow == 0 or len(row) < 2: continue
+      population[row[0]] = float(row[1])
+  return population
+
+# Average over the window dates ending on each date, from differences of a cumulative sum
+# Returns (average, valid) with valid False unless all window dates are valid
+def movingAverage(values, valid, window):
+  nCountries, nDates = values.shape
+  sums = np.zeros((nCountries, nDates+1))
+  np.cumsum(np.where(valid, values, 0), axis=1, out=sums[:, 1:])
+  counts = np.zeros((nCountries, nDates+1), dtype=np.int64)
+  np.cumsum(valid, axis=1, out=counts[:, 1:])
+  average = np.zeros((nCountries, nDates))
+  averageValid = np.zeros((nCountries, nDates), dtype=bool)
+  if window <= nDates:
+    average[:, window-1:] = (sums[:, window:] - sums[:, :-window]) / window
+    averageValid[:, window-1:] = (counts[:, window:] - counts[:, :-window]) == window
+  return np.where(averageValid, average, 0.), averageValid
+
+# Mean daily growth rate of a cumulative series over the window dates before each date: (total/totalWindowDaysBefore)^(1/window) - 1
+def growthRate(totals, valid, window):
+  growth = np.zeros(totals.shape)
+  growthValid = np.zeros(totals.shape, dtype=bool)
+  if window < totals.shape[1]:
+    current, previous = totals[:, window:], totals[:, :-window]
+    growthValid[:, window:] = valid[:, window:] & valid[:, :-window] & (previous > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      growth[:, window:] = np.where(growthValid[:, window:], (current/np.where(previous > 0, previous, 1.))**(1./window) - 1, 0.)
+  return growth, growthValid
+
+# Returns a TimeSeries with float values holding the metrics of data followed by the rolling metrics
+# for all countries at once. population[country] = number of people enables the per million metrics for that country.
+def addRollingStatistics(data, window=7, population={}):
+  nBase = len(metricNames)
+  values = np.zeros(data.values.shape[:2]+(len(allMetricNames),))
+  valid = np.zeros(values.shape, dtype=bool)
+  values[:, :, :nBase] = data.values[:, :, :nBase]
+  valid[:, :, :nBase] = data.valid[:, :, :nBase]
+  def setMetric(name, metric, metricValid):
+    iMetric = allMetricNames.index(name)
+    values[:, :, iMetric] = metric
+    valid[:, :, iMetric] = metricValid
+
+  setMetric('newCasesAverage', *movingAverage(values[:, :, 0], valid[:, :, 0], window))
+  setMetric('newDeathsAverage', *movingAverage(values[:, :, 1], valid[:, :, 1], window))
+  growth, growthValid = growthRate(values[:, :, 3], valid[:, :, 3], window)
+  setMetric('growthRate', growth, growthValid)
+  # Days for totalCases to double at the current growth rate, only when cases are growing
+  doublingValid = growthValid & (growth > 0)
+  with np.errstate(divide='ignore'):
+    setMetric('doublingTime', np.where(doublingValid, np.log(2.)/np.log1p(np.where(doublingValid, growth, 1.)), 0.), doublingValid)
+
+  # Per million people, for countries with a known population
+  perMillion = np.array([1e6/population[country] if population.get(country, 0) > 0 else 0. for country in data.countries])[:, None]
+  hasPopulation = perMillion != 0
+  for name, source in [('totalCasesPerMillion', 'totalCases'), ('totalDeathsPerMillion', 'totalDeaths'), ('newCasesAveragePerMillion', 'newCasesAverage')]:
+    iSource = allMetricNames.index(source)
+    setMetric(name, values[:, :, iSource]*perMillion, valid[:, :, iSource] & hasPopulation)
+
+  statistics = TimeSeries(data.countries, data.dateAxis, values, valid)
+  statistics.sourceHashes = data.sourceHashes
+  statistics.hierarchy = data.hierarchy
+  return statistics
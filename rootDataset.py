@@ -0,0 +1,174 @@
+#!/usr/bin/env python3.6
+import collections
+import json
+import os
+import numpy as np
+import profiling
+from timeSeries import metricNames
+from alignCases import Alignment
+
+# Bump when the tree layout changes so old files are rewritten
+treeVersion = 1
+
+# Tree 'cases' with one entry per country:
+#   country (std::string)
+#   date (std::vector<int>) = days since 1970-01-01
+#   newCases, newDeaths, ... totalActiveCases (std::vector<Long64_t>) = one value per date
+#   valid (std::vector<unsigned char>) = bit iMetric set when the metric has data on that date
+# A TNamed 'index' holds json {'treeVersion', 'sourceHashes'}
+# ROOT is imported inside the functions so importing this module stays cheap
+helpers = '''
+#include <limits>
+#include <string>
+#include <vector>
+#include "ROOT/RVec.hxx"
+void fillIntVector(std::vector<int>& v, const int* x, int n) { v.assign(x, x+n); }
+void fillLongVector(std::vector<Long64_t>& v, const Long64_t* x, int n) { v.assign(x, x+n); }
+void fillCharVector(std::vector<unsigned char>& v, const unsigned char* x, int n) { v.assign(x, x+n); }
+
+// Daily values from a cumulative series, 0 on the first date
+ROOT::RVec<Long64_t> firstDifference(const ROOT::RVec<Long64_t>& totals) {
+  ROOT::RVec<Long64_t> news(totals.size(), 0);
+  for (size_t i = 1; i < totals.size(); ++i) news[i] = totals[i] - totals[i-1];
+  return news;
+}
+
+// Values of a metric on the dates where it has data
+ROOT::RVec<double> compactSeries(const ROOT::RVec<Long64_t>& cases, const ROOT::RVec<unsigned char>& valid, int iMetric) {
+  ROOT::RVec<double> points;
+  for (size_t i = 0; i < cases.size(); ++i) if (valid[i] & (1 << iMetric)) points.push_back(cases[i]);
+  return points;
+}
+
+// First point whose increase to the next point is above lowLimitCase, -1 if none
+int onsetIndex(const ROOT::RVec<double>& points, double lowLimitCase) {
+  for (size_t i = 0; i + 1 < points.size(); ++i) if (points[i+1] - points[i] > lowLimitCase) return i;
+  return -1;
+}
+
+// Value of a metric on the last date it has data, -inf when it has none so it ranks below every value as in query.Query
+double lastValue(const ROOT::RVec<Long64_t>& cases, const ROOT::RVec<unsigned char>& valid, int iMetric) {
+  for (size_t i = cases.size(); i > 0; --i) if (valid[i-1] & (1 << iMetric)) return cases[i-1];
+  return -std::numeric_limits<double>::infinity();
+}
+'''
+
+helpersDeclared = False
+def declareHelpers():
+  import ROOT
+  global helpersDeclared
+  if helpersDeclared: return
+  ROOT.gInterpreter.Declare(helpers)
+  # Tree building and alignment run on all cores
+  ROOT.EnableImplicitMT()
+  helpersDeclared = True
+
+def loadTreeIndex(treePath):
+  import ROOT
+  if not os.path.exists(treePath): return {}
+  inFile = ROOT.TFile.Open(treePath)
+  if not inFile or inFile.IsZombie(): return {}
+  named = inFile.Get('index')
+  index = json.loads(named.GetTitle()) if named else {}
+  inFile.Close()
+  if index.get('treeVersion') != treeVersion: return {}
+  return index
+
+# Writes data to a compressed tree at treePath unless it already holds the same source data
+# When derive is True the daily and active metrics are computed with RDataFrame from the totals,
+# otherwise all metrics are written as they are in data
+def updateTree(data, treePath, derive=False):
+  import ROOT
+  if len(data.sourceHashes) != 0 and loadTreeIndex(treePath).get('sourceHashes') == data.sourceHashes:
+    print('Reusing '+treePath)
+    return
+  declareHelpers()
+  derivedMetrics = [0, 1, 2, 6] if derive else []
+
+  # Raw tree, filled from the arrays with one C++ copy per branch and country
+  rawPath = treePath+'.raw'
+  rawFile = ROOT.TFile(rawPath, 'RECREATE')
+  tree = ROOT.TTree('cases', 'cases')
+  country = ROOT.std.string()
+  dates = ROOT.std.vector('int')()
+  valid = ROOT.std.vector('unsigned char')()
+  metrics = collections.OrderedDict((iMetric, ROOT.std.vector('Long64_t')()) for iMetric in range(len(metricNames)) if iMetric not in derivedMetrics)
+  tree.Branch('country', country)
+  tree.Branch('date', dates)
+  tree.Branch('valid', valid)
+  for iMetric in metrics: tree.Branch(metricNames[iMetric], metrics[iMetric])
+  days = np.ascontiguousarray(data.dateAxis.astype(np.int64).astype(np.int32))
+  bits = (np.asarray(data.valid).astype(np.uint8) << np.arange(len(metricNames), dtype=np.uint8)).sum(axis=2, dtype=np.uint8)
+  for iCountry, name in enumerate(data.countries):
+    country.assign(name)
+    ROOT.fillIntVector(dates, days, len(days))
+    ROOT.fillCharVector(valid, np.ascontiguousarray(bits[iCountry]), len(days))
+    for iMetric in metrics:
+      ROOT.fillLongVector(metrics[iMetric], np.ascontiguousarray(data.values[iCountry, :, iMetric]), len(days))
+    tree.Fill()
+  tree.Write()
+  rawFile.Close()
+
+  # Derive the remaining metrics and write the final compressed tree
+  frame = ROOT.RDataFrame('cases', rawPath)
+  if derive:
+    frame = frame.Define('newCases', 'firstDifference(totalCases)')
+    frame = frame.Define('newDeaths', 'firstDifference(totalDeaths)')
+    frame = frame.Define('newRecoveries', 'firstDifference(totalRecoveries)')
+    frame = frame.Define('totalActiveCases', 'totalCases - totalRecoveries')
+  columns = ROOT.std.vector('std::string')()
+  for name in ['country', 'date', 'valid'] + metricNames: columns.push_back(name)
+  options = ROOT.RDF.RSnapshotOptions()
+  options.fCompressionAlgorithm = ROOT.RCompressionSetting.EAlgorithm.kZSTD
+  options.fCompressionLevel = 5
+  frame.Snapshot('cases', treePath, columns, options)
+  os.remove(rawPath)
+
+  outFile = ROOT.TFile(treePath, 'UPDATE')
+  ROOT.TNamed('index', json.dumps({'treeVersion': treeVersion, 'sourceHashes': data.sourceHashes})).Write()
+  outFile.Close()
+  print('Saving '+treePath)
+
+# Same as alignCases.alignCases, with the per-country work done by RDataFrame on the tree at treePath
+def alignTree(treePath, interestedIndex=3, lowLimitCase=200, dayLimit=-1, interestedCountries=[], ignoreCountries=[], maxExcludeCountry=[], sortIndex=4, maxCountries=-1):
+  import ROOT
+  declareHelpers()
+  frame = ROOT.RDataFrame('cases', treePath)
+  frame = frame.Define('points', 'compactSeries(%s, valid, %d)' % (metricNames[interestedIndex], interestedIndex))
+  frame = frame.Define('entry', '(Long64_t)rdfentry_')
+  frame = frame.Define('onset', 'onsetIndex(points, %r)' % float(lowLimitCase))
+  frame = frame.Define('sortValue', 'lastValue(%s, valid, %d)' % (metricNames[sortIndex], sortIndex))
+  with profiling.stage('align') as timer:
+    columns = frame.AsNumpy(['country', 'entry', 'points', 'onset', 'sortValue'])
+    timer.add(countries=len(columns['country']))
+
+  # Entries arrive in any order with implicit multithreading
+  # Sort by the latest value of sortIndex, then by entry as the tree is written in country order
+  countries = [str(country) for country in columns['country']]
+  order = sorted(range(len(countries)), key=lambda i: (-columns['sortValue'][i], columns['entry'][i]))
+  interestedCountries, ignoreCountries = set(interestedCountries), set(ignoreCountries)
+  nSelected = 0
+  series = collections.OrderedDict()
+  onsets = collections.OrderedDict()
+  minEntry, maxEntry, maxDays = 0, 0, 0
+  for i in order:
+    country = countries[i]
+    # Ignore countries
+    if country in ignoreCountries: continue
+    # Select interested countries
+    if len(interestedCountries) != 0 and country not in interestedCountries: continue
+    if nSelected == maxCountries: break
+    nSelected += 1
+    # As in alignCases, the first maxCountries are selected before countries without data are dropped
+    points = np.asarray(columns['points'][i], dtype=np.float64)
+    if len(points) == 0: continue
+    onset = int(columns['onset'][i])
+    onsets[country] = onset if onset != -1 else len(points)
+    series[country] = points[onsets[country]:]
+    # Axis bounds from the first dayLimit aligned days
+    window = series[country] if dayLimit == -1 else series[country][:dayLimit]
+    if country not in maxExcludeCountry and len(window) != 0:
+      minEntry = min(minEntry, window.min())
+      maxEntry = max(maxEntry, window.max())
+      maxDays = max(maxDays, len(window)-1)
+  return Alignment(series, onsets, minEntry, maxEntry, maxDays)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+import bisect
+import difflib
+import hashlib
+import json
+import os
+import zlib
+
+# Archive of the source files of --dateTag runs
+#   archiveFolder/index.json = {'snapshots': {tag: {filename: sha256}}, 'objects': {sha256: {'base', 'depth', 'size', 'storedSize'}}}
+#   archiveFolder/objects/sha256 = zlib compressed content, or a delta against the object 'base' when base is not None
+# Identical files are stored once. A file is stored as a delta against the same file of the previous snapshot,
+# unless that would make a chain longer than maxDepth, so any snapshot is rebuilt from at most maxDepth deltas.
+maxDepth = 32
+
+def indexPath(archiveFolder):
+  return os.path.join(archiveFolder, 'index.json')
+
+def objectPath(archiveFolder, sha256):
+  return os.path.join(archiveFolder, 'objects', sha256)
+
+def loadIndex(archiveFolder):
+  if not os.path.exists(indexPath(archiveFolder)): return {'snapshots': {}, 'objects': {}}
+  with open(indexPath(archiveFolder)) as inFile:
+    return json.load(inFile)
+
+def saveIndex(archiveFolder, index):
+  with open(indexPath(archiveFolder)+'.part', 'w') as outFile:
+    json.dump(index, outFile, indent=1, sort_keys=True)
+  os.replace(indexPath(archiveFolder)+'.part', indexPath(archiveFolder))
+
+# Delta of newText against baseText as a list of line operations
+#   ['=', start, end]        copy base lines [start, end)
+#   ['^', start, [suffix]]   base lines from start, each followed by its suffix (columns added to a wide csv)
+#   ['+', text]              new lines
+def makeDelta(baseText, newText):
+  baseLines = baseText.splitlines(True)
+  newLines = newText.splitlines(True)
+  delta = []
+  matcher = difflib.SequenceMatcher(None, baseLines, newLines, autojunk=False)
+  for tag, baseStart, baseEnd, newStart, newEnd in matcher.get_opcodes():
+    if tag == 'equal':
+      delta.append(['=', baseStart, baseEnd])
+      continue
+    # Lines that only grew at their end are stored as suffixes
+    iNew = newStart
+    for iBase in range(baseStart, min(baseEnd, baseStart+newEnd-newStart)):
+      base, new = baseLines[iBase].rstrip('\r\n'), newLines[iNew]
+      if not new.startswith(base): break
+      if len(delta) != 0 and delta[-1][0] == '^' and delta[-1][1]+len(delta[-1][2]) == iBase: delta[-1][2].append(new[len(base):])
+      else: delta.append(['^', iBase, [new[len(base):]]])
+      iNew += 1
+    if iNew != newEnd: delta.append(['+', ''.join(newLines[iNew:newEnd])])
+  return delta
+
+def applyDelta(baseText, delta):
+  baseLines = baseText.splitlines(True)
+  parts = []
+  for operation in delta:
+    if operation[0] == '=': parts.extend(baseLines[operation[1]:operation[2]])
+    elif operation[0] == '^':
+      for iLine, suffix in enumerate(operation[2], operation[1]): parts.append(baseLines[iLine].rstrip('\r\n')+suffix)
+    else: parts.append(operation[1])
+  return ''.join(parts)
+
+# Content of an archived object, applying its chain of deltas
+def readObject(archiveFolder, sha256, index=None):
+  if index is None: index = loadIndex(archiveFolder)
+  # Follow the chain down to the full object, then apply the deltas back up
+  chain = [sha256]
+  while index['objects'][chain[-1]]['base'] is not None: chain.append(index['objects'][chain[-1]]['base'])
+  content = None
+  for objectSha in reversed(chain):
+    with open(objectPath(archiveFolder, objectSha), 'rb') as inFile:
+      stored = zlib.decompress(inFile.read())
+    if content is None: content = stored if len(chain) == 1 else stored.decode('utf-8')
+    else: content = applyDelta(content, json.loads(stored.decode('utf-8')))
+  if len(chain) != 1: content = content.encode('utf-8')
+  if hashlib.sha256(content).hexdigest() != sha256: raise IOError('Archived object '+sha256+' is corrupt')
+  return content
+
+# Tag of the latest snapshot before tag that has filename
+def previousSnapshot(index, tag, filename):
+  tags = sorted(index['snapshots'])
+  for previousTag in reversed(tags[:bisect.bisect_left(tags, tag)]):
+    if filename in index['snapshots'][previousTag]: return previousTag
+  return None
+
+# Adds the files of the run tagged tag to the archive
+# filepaths are the tagged files of the run; they are archived under their name without the tag
+# Returns {filename: sha256}
+def addSnapshot(archiveFolder, tag, filepaths):
+  if not os.path.exists(os.path.join(archiveFolder, 'objects')): os.makedirs(os.path.join(archiveFolder, 'objects'))
+  index = loadIndex(archiveFolder)
+  snapshot = index['snapshots'].get(tag, {})
+  for filepath in filepaths:
+    filename = os.path.basename(filepath)
+    if filename.startswith(tag): filename = filename[len(tag):]
+    with open(filepath, 'rb') as inFile:
+      content = inFile.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+    snapshot[filename] = sha256
+    # Same content as an archived file
+    if sha256 in index['objects']: continue
+
+    stored, entry = None, {'base': None, 'depth': 0, 'size': len(content)}
+    previousTag = previousSnapshot(index, tag, filename)
+    if previousTag is not None:
+      baseSha = index['snapshots'][previousTag][filename]
+      if index['objects'][baseSha]['depth'] < maxDepth:
+        try:
+          delta = makeDelta(readObject(archiveFolder, baseSha, index).decode('utf-8'), content.decode('utf-8'))
+          stored = zlib.compress(json.dumps(delta, separators=(',', ':')).encode('utf-8'), 9)
+          entry = {'base': baseSha, 'depth': index['objects'][baseSha]['depth']+1, 'size': len(content)}
+        except UnicodeDecodeError:
+          pass
+    # Deltas that are not clearly smaller than the compressed file start a new chain
+    if stored is None or len(stored) > len(content)//16:
+      full = zlib.compress(content, 9)
+      if stored is None or len(full) <= 2*len(stored): stored, entry = full, {'base': None, 'depth': 0, 'size': len(content)}
+    with open(objectPath(archiveFolder, sha256)+'.part', 'wb') as outFile:
+      outFile.write(stored)
+    os.replace(objectPath(archiveFolder, sha256)+'.part', objectPath(archiveFolder, sha256))
+    entry['storedSize'] = len(stored)
+    index['objects'][sha256] = entry
+  index['snapshots'][tag] = snapshot
+  saveIndex(archiveFolder, index)
+  print('Archived %d files of %s in %s' % (len(filepaths), tag, archiveFolder))
+  return snapshot
+
+# Writes the files of the snapshot tagged tag to folder, with the tag in front of their names as in the original run
+# Returns the restored paths
+def restoreSnapshot(archiveFolder, tag, folder):
+  index = loadIndex(archiveFolder)
+  if tag not in index['snapshots']: raise KeyError('No snapshot '+tag+' in '+archiveFolder)
+  if not os.path.exists(folder): os.makedirs(folder)
+  filepaths = []
+  for filename, sha256 in sorted(index['snapshots'][tag].items()):
+    filepath = os.path.join(folder, tag+filename)
+    with open(filepath+'.part', 'wb') as outFile:
+      outFile.write(readObject(archiveFolder, sha256, index))
+    os.replace(filepath+'.part', filepath)
+    filepaths.append(filepath)
+  print('Restored %d files of %s from %s' % (len(filepaths), tag, archiveFolder))
+  return filepaths
+
+# Size of the archived files as (size of the original files, size in the archive), in bytes
+def archiveSize(archiveFolder):
+  index = loadIndex(archiveFolder)
+  original = sum(index['objects'][sha256]['size'] for snapshot in index['snapshots'].values() for sha256 in snapshot.values())
+  return original, sum(entry['storedSize'] for entry in index['objects'].values())
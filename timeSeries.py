@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+try:
+  from collections.abc import Mapping
+except ImportError:
+  from collections import Mapping
+import datetime
+import numpy as np
+
+# Layout of the metric axis of TimeSeries.values
+# (0: newCases, 1: newDeaths, 2: newRecoveries, 3: totalCases, 4: totalDeaths, 5: totalRecoveries, 6: totalActiveCases)
+metricNames = ['newCases', 'newDeaths', 'newRecoveries', 'totalCases', 'totalDeaths', 'totalRecoveries', 'totalActiveCases']
+nMetrics = len(metricNames)
+
+def toDatetime64(date):
+  return np.datetime64(date, 'D')
+
+def toDatetime(date64):
+  return datetime.datetime.combine(date64.astype(datetime.date), datetime.time())
+
+# Dense columnar store of case data
+# values[iCountry, iDate, iMetric] = case (int64)
+# valid[iCountry, iDate, iMetric] = False when the source has no entry for the cell (None in the old dict format)
+# countries[iCountry] = country, dates[iDate] = datetime
+# sourceHashes[filename] = sha256 of the source files the data was built from
+# regions = TimeSeries of the regions (Province/State) that roll up into these countries, if the source has them.
+#   It can be set to a function returning it, which is called the first time regions is used
+# hierarchy = RegionHierarchy of the rows of a region-level TimeSeries
+# query = query.Query over this data, made on first use by query.queryOf
+# sources = names of the datasets merged into this one by mergeTimeSeries, and
+# provenance[iCountry, iDate, iMetric] = 1 + index in sources of the dataset a cell comes from, 0 where none has it
+#
+# Behaves like the old OrderedDict so data[country][date] still returns
+# (newCases, newDeaths, newRecoveries, totalCases, totalDeaths, totalRecoveries, totalActiveCases)
+class TimeSeries(Mapping):
+  def __init__(self, countries, dates, values=None, valid=None):
+    self.countries = list(countries)
+    self.countryIndex = dict((country, iCountry) for iCountry, country in enumerate(self.countries))
+    self.dateAxis = np.array([toDatetime64(date) for date in dates], dtype='datetime64[D]')
+    self.dates = [toDatetime(date) for date in self.dateAxis]
+    self.dateIndex = dict((date, iDate) for iDate, date in enumerate(self.dates))
+    shape = (len(self.countries), len(self.dates), nMetrics)
+    self.values = np.zeros(shape, dtype=np.int64) if values is None else values
+    self.valid = np.ones(shape, dtype=bool) if valid is None else valid
+    self.sourceHashes = {}
+    self.regions = None
+    self.hierarchy = None
+    self.query = None
+    self.sources = []
+    self.provenance = None
+
+  # Lookups
+  def index(self, country):
+    return self.countryIndex[country]
+
+  # Raises KeyError when date is not on the date axis
+  def indexOfDate(self, date):
+    if isinstance(date, datetime.datetime): return self.dateIndex[date]
+    iDate = int(np.searchsorted(self.dateAxis, toDatetime64(date)))
+    if iDate == len(self.dateAxis) or self.dateAxis[iDate] != toDatetime64(date): raise KeyError(date)
+    return iDate
+
+  # metric(iMetric)[iCountry, iDate] = case
+  def metric(self, iMetric):
+    return self.values[:, :, iMetric]
+
+  # series(country, iMetric)[iDate] = case
+  def series(self, country, iMetric):
+    return self.values[self.countryIndex[country], :, iMetric]
+
+  def value(self, country, date, iMetric):
+    iCountry = self.countryIndex[country]
+    iDate = self.indexOfDate(date)
+    if not self.valid[iCountry, iDate, iMetric]: return None
+    return self.values[iCountry, iDate, iMetric].item()
+
+  # Returns a TimeSeries sharing memory with this one for dates in [startDate, endDate)
+  def sliceDates(self, startDate=None, endDate=None):
+    start = 0 if startDate is None else int(np.searchsorted(self.dateAxis, toDatetime64(startDate)))
+    end = len(self.dates) if endDate is None else int(np.searchsorted(self.dateAxis, toDatetime64(endDate)))
+    return TimeSeries(self.countries, self.dateAxis[start:end], self.values[:, start:end], self.valid[:, start:end])
+
+  # Returns a TimeSeries with only the selected countries
+  def selectCountries(self, countries):
+    indices = [self.countryIndex[country] for country in countries]
+    return TimeSeries(countries, self.dateAxis, self.values[indices], self.valid[indices])
+
+  @property
+  def regions(self):
+    if callable(self.regionsLoader): self.regionsLoader = self.regionsLoader()
+    return self.regionsLoader
+
+  @regions.setter
+  def regions(self, regions):
+    self.regionsLoader = regions
+
+  @property
+  def nbytes(self):
+    return self.values.nbytes + self.valid.nbytes
+
+  # Compatibility view: data[country] -> CountryView
+  def __getitem__(self, country):
+    return CountryView(self, self.countryIndex[country])
+
+  def __iter__(self):
+    return iter(self.countries)
+
+  def __len__(self):
+    return len(self.countries)
+
+  def __contains__(self, country):
+    return country in self.countryIndex
+
+# Name of a region row: 'Province/State, Country/Region', or only the country when it has no province
+def regionName(region, country):
+  if region == '': return country
+  return region+', '+country
+
+# Region -> country index of a region-level TimeSeries
+# regions[iRegion] = region name, countryOfRegion[iRegion] = index in countries
+# latitudes[iRegion], longitudes[iRegion] = position of the region (nan when unknown)
+# aliases[alias] = country, for country names that appear under several names in the source
+# Rows are summed into countries with one grouped reduction over regions sorted by country
+class RegionHierarchy(object):
+  def __init__(self, regions, regionCountries, latitudes=None, longitudes=None, aliases={}):
+    self.regions = list(regions)
+    self.aliases = dict(aliases)
+    regionCountries = [self.aliases.get(country, country) for country in regionCountries]
+    self.countries = sorted(set(regionCountries))
+    self.countryIndex = dict((country, iCountry) for iCountry, country in enumerate(self.countries))
+    self.countryOfRegion = np.array([self.countryIndex[country] for country in regionCountries], dtype=np.intp)
+    nanArray = np.full(len(self.regions), np.nan)
+    self.latitudes = nanArray if latitudes is None else np.asarray(latitudes, dtype=np.float64)
+    self.longitudes = nanArray if longitudes is None else np.asarray(longitudes, dtype=np.float64)
+    # order groups the regions of each country, starts[iCountry] = first of its regions in order
+    self.order = np.argsort(self.countryOfRegion, kind='stable')
+    self.starts = np.searchsorted(self.countryOfRegion[self.order], np.arange(len(self.countries)))
+
+  def country(self, region):
+    return self.countries[self.countryOfRegion[self.regions.index(region)]]
+
+  # Regions of a country, or of the country an alias stands for
+  def regionsOf(self, country):
+    iCountry = self.countryIndex[self.aliases.get(country, country)]
+    return [self.regions[iRegion] for iRegion in np.flatnonzero(self.countryOfRegion == iCountry)]
+
+  # rollUp(values)[iCountry, ...] = sum of values[iRegion, ...] over the regions of the country
+  def rollUp(self, values, reduce=np.add):
+    if len(self.regions) == 0: return np.zeros((0,)+values.shape[1:], dtype=values.dtype)
+    return reduce.reduceat(np.asarray(values)[self.order], self.starts, axis=0)
+
+  # Sum over all regions
+  def total(self, values):
+    return np.asarray(values).sum(axis=0)
+
+  def toDict(self):
+    return {'regions': self.regions, 'countries': [self.countries[iCountry] for iCountry in self.countryOfRegion],
+        'latitudes': [None if np.isnan(x) else x for x in self.latitudes.tolist()],
+        'longitudes': [None if np.isnan(x) else x for x in self.longitudes.tolist()],
+        'aliases': self.aliases}
+
+  @classmethod
+  def fromDict(cls, index):
+    return cls(index['regions'], index['countries'], np.array(index['latitudes'], dtype=np.float64), np.array(index['longitudes'], dtype=np.float64), index['aliases'])
+
+# Rolls a region-level TimeSeries up to its countries, with values summed and a cell valid when any region is valid
+def rollUpRegions(regionData):
+  hierarchy = regionData.hierarchy
+  data = TimeSeries(hierarchy.countries, regionData.dateAxis, hierarchy.rollUp(regionData.values), hierarchy.rollUp(regionData.valid, np.logical_or))
+  data.regions = regionData
+  return data
+
+# Compatibility view of one country: view[date] = [case per metric], None where the cell is not valid
+# Cases are int, or float for float values such as those of rollingStatistics
+# Only dates with at least one valid metric are listed, as in the old OrderedDict
+class CountryView(Mapping):
+  def __init__(self, timeSeries, iCountry):
+    self.timeSeries = timeSeries
+    self.iCountry = iCountry
+    self.dateIndices = np.flatnonzero(timeSeries.valid[iCountry].any(axis=1))
+
+  def __getitem__(self, date):
+    iDate = self.timeSeries.dateIndex[date]
+    valid = self.timeSeries.valid[self.iCountry, iDate]
+    if not valid.any(): raise KeyError(date)
+    values = self.timeSeries.values[self.iCountry, iDate]
+    return [value.item() if isValid else None for value, isValid in zip(values, valid)]
+
+  def __iter__(self):
+    dates = self.timeSeries.dates
+    return (dates[iDate] for iDate in self.dateIndices)
+
+  def __len__(self):
+    return len(self.dateIndices)
+
+# Derives (newCases, newDeaths, newRecoveries) as first differences of (totalCases, totalDeaths, totalRecoveries)
+# and totalActiveCases = totalCases - totalRecoveries, for all countries at once.
+# dateIndices limits the update to those date columns; by default all dates are derived.
+# Returns corrections[iCountry, iDate, iNew] = True where a cumulative series went down (negative daily value),
+# with iDate running over dateIndices.
+# clipCorrections sets those daily values to 0 instead of keeping the negative value.
+def deriveMetrics(data, clipCorrections=False, dateIndices=None):
+  if dateIndices is None: dateIndices = np.arange(len(data.dates))
+  dateIndices = np.asarray(dateIndices, dtype=np.intp)
+  totals = data.values[:, dateIndices, 3:6]
+  # The first date has no previous day so its daily values are 0
+  news = totals - data.values[:, np.maximum(dateIndices-1, 0), 3:6]
+  corrections = news < 0
+  if clipCorrections: news[corrections] = 0
+  data.values[:, dateIndices, 0:3] = news
+  data.values[:, dateIndices, 6] = totals[:, :, 0] - totals[:, :, 2]
+  return corrections
+
+# Joins datasets onto one country index and date axis, each dataset in one vectorized pass
+# sources = [(name, data)] in order of priority: a cell is taken from the first dataset where it is valid
+# aliases[alias] = country maps country names of any dataset to the merged name; countries mapped to
+# the same name within a dataset are summed
+def mergeTimeSeries(sources, aliases={}):
+  hierarchies = [RegionHierarchy(data.countries, data.countries, aliases=aliases) for name, data in sources]
+  countries = sorted(set(country for hierarchy in hierarchies for country in hierarchy.countries))
+  dateAxis = np.array([], dtype='datetime64[D]')
+  for name, data in sources: dateAxis = np.union1d(dateAxis, data.dateAxis)
+  merged = TimeSeries(countries, dateAxis)
+  merged.valid[:] = False
+  merged.provenance = np.zeros(merged.values.shape, dtype=np.uint8)
+  merged.sources = [name for name, data in sources]
+  for iSource, ((name, data), hierarchy) in enumerate(zip(sources, hierarchies)):
+    cells = np.ix_([merged.countryIndex[country] for country in hierarchy.countries], np.searchsorted(dateAxis, data.dateAxis))
+    valid = hierarchy.rollUp(data.valid[:, :, :nMetrics], np.logical_or)
+    fill = valid & ~merged.valid[cells]
+    merged.values[cells] = np.where(fill, hierarchy.rollUp(data.values[:, :, :nMetrics]), merged.values[cells])
+    merged.valid[cells] |= fill
+    merged.provenance[cells] = np.where(fill, iSource+1, merged.provenance[cells])
+    merged.sourceHashes.update(data.sourceHashes)
+  return merged